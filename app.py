@@ -1,104 +1,555 @@
 # app.py
 
 import requests
-from bs4 import BeautifulSoup
-import re
+import os
+import hmac
+import json
+import time
+import atexit
 import logging
-from flask import Flask, render_template, request, jsonify
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import (
+    Flask, Response, abort, g, jsonify, redirect, render_template, request, send_file, stream_with_context, url_for,
+)
+
+from card_cache import MemoryCardCache, SqliteCardCache, is_valid_cert, normalize_cert
+from images import SLAB_IMAGE_URL, THUMBNAIL_FORMATS, ImageNotFound, OriginalMirror, ThumbnailStore
+import parsers
+from jobs import JobQueue, QueueFull
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsRegistry
+from parsers import get_parser
+from profiling import RequestProfile, RollingStackSampler, format_collapsed
+from renderer import BrowserPool
+from upstream import (
+    AdaptiveRateLimiter, CircuitBreaker, CircuitOpen, SingleFlight, UpstreamThrottled, create_http_session,
+    take_connect_seconds,
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 app = Flask(__name__)
+# Let a fronting Apache/lighttpd stream files via X-Sendfile instead of Python
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', '').lower() in ('1', 'true', 'yes')
+
+# Upper bound on concurrent upstream fetches for a single batch lookup
+BATCH_MAX_WORKERS = int(os.environ.get('SCRAPE_BATCH_WORKERS', 8))
+# Largest number of cert numbers accepted by one /scrape/batch request
+BATCH_MAX_CERTS = int(os.environ.get('SCRAPE_BATCH_MAX_CERTS', 500))
+
+# Card pages live under this prefix; overridable so a local fixture server can stand in
+TAG_CARD_URL = os.environ.get('TAG_CARD_URL', 'https://my.taggrading.com/card/')
+UPSTREAM_TIMEOUT = float(os.environ.get('UPSTREAM_TIMEOUT', 10))
+
+# One keep-alive connection pool shared by every scrape path
+http_session = create_http_session(
+    pool_size=int(os.environ.get('UPSTREAM_POOL_SIZE', max(16, BATCH_MAX_WORKERS))),
+    retries=int(os.environ.get('UPSTREAM_RETRIES', 2)),
+    backoff_factor=float(os.environ.get('UPSTREAM_RETRY_BACKOFF', 0.3)),
+)
+
+# Token bucket shared by every request to the TAG upstream; adapts to 429/503 and Retry-After
+rate_limiter = AdaptiveRateLimiter(
+    rate=float(os.environ.get('UPSTREAM_RATE', 5)),
+    burst=int(os.environ.get('UPSTREAM_BURST', 10)),
+    min_rate=float(os.environ.get('UPSTREAM_MIN_RATE', 0.2)),
+    max_rate=float(os.environ.get('UPSTREAM_MAX_RATE', 20)),
+)
+# Longest a request may queue for a token before it is failed instead
+UPSTREAM_MAX_QUEUE_WAIT = float(os.environ.get('UPSTREAM_MAX_QUEUE_WAIT', 30))
+
+# Stops sending traffic to the upstream while it is failing or slow, so workers fail fast
+upstream_breaker = CircuitBreaker(
+    window=float(os.environ.get('BREAKER_WINDOW', 60)),
+    min_calls=int(os.environ.get('BREAKER_MIN_CALLS', 10)),
+    failure_rate=float(os.environ.get('BREAKER_FAILURE_RATE', 0.5)),
+    slow_call=float(os.environ.get('BREAKER_SLOW_CALL', 5)),
+    slow_rate=float(os.environ.get('BREAKER_SLOW_RATE', 0.8)),
+    open_seconds=float(os.environ.get('BREAKER_OPEN_SECONDS', 30)),
+)
+
+# Grades on a cert rarely change, so scraped results are kept in memory for a day by default
+card_cache = MemoryCardCache(
+    ttl=float(os.environ.get('CARD_CACHE_TTL', 86400)),
+    max_entries=int(os.environ.get('CARD_CACHE_MAX_ENTRIES', 10000)),
+    max_bytes=int(os.environ.get('CARD_CACHE_MAX_BYTES', 32 * 1024 * 1024)),
+)
+
+# Certs the upstream reported as nonexistent, remembered for a shorter time than real cards
+negative_cache = MemoryCardCache(
+    ttl=float(os.environ.get('NEGATIVE_CACHE_TTL', 600)),
+    max_entries=int(os.environ.get('NEGATIVE_CACHE_MAX_ENTRIES', 10000)),
+)
+INVALID_CERT_ERROR = "That does not look like a TAG cert number (one letter followed by seven digits)."
+NOT_FOUND_ERROR = "No TAG card exists with that cert number."
+
+# On-disk copy shared by every worker on the host and kept across restarts; set CARD_CACHE_DB='' to disable
+CARD_CACHE_DB = os.environ.get('CARD_CACHE_DB', 'card_cache.sqlite3')
+disk_cache = SqliteCardCache(CARD_CACHE_DB, ttl=card_cache.ttl) if CARD_CACHE_DB else None
+
+# Extraction engine for card pages: 'embedded' (default, JSON state with a DOM fallback), 'partial', 'lxml' or 'soup'
+CARD_PARSER = os.environ.get('CARD_PARSER')
+parse_card_html = get_parser(CARD_PARSER)
+
+# Warm headless browsers for pages that need JavaScript; 0 disables the rendered path
+RENDERER_POOL_SIZE = int(os.environ.get('RENDERER_POOL_SIZE', 0))
+renderer_pool = None
+if RENDERER_POOL_SIZE > 0:
+    renderer_pool = BrowserPool(
+        size=RENDERER_POOL_SIZE,
+        max_uses=int(os.environ.get('RENDERER_MAX_USES', 200)),
+        wait_timeout=float(os.environ.get('RENDERER_WAIT_TIMEOUT', 10)),
+    )
+    threading.Thread(target=renderer_pool.warm, daemon=True).start()
+    atexit.register(renderer_pool.close)
+
+# Fields whose 'N/A' sends a cert from the plain HTTP tier on to the rendered tier
+REQUIRED_FIELDS = tuple(
+    field.strip()
+    for field in os.environ.get('SCRAPE_REQUIRED_FIELDS', 'player_name,set_name,tag_score,grade').split(',')
+    if field.strip()
+)
+# How many certs each fetch tier has served
+tier_counts = {'http': 0, 'rendered': 0}
+tier_counts_lock = threading.Lock()
+
+# Resized slab images served from local disk instead of the full-size S3 originals
+THUMBNAIL_WIDTHS = tuple(int(w) for w in os.environ.get('THUMBNAIL_WIDTHS', '240,480,720').split(','))
+thumbnail_store = ThumbnailStore(
+    os.environ.get('THUMBNAIL_DIR', 'thumbnail_cache'),
+    http_session,
+    widths=THUMBNAIL_WIDTHS,
+)
+# Thumbnails for a cert never change, so browsers may keep them for a year
+THUMBNAIL_MAX_AGE = 365 * 24 * 3600
+
+# Optional local mirror of full-size slab images; 0 bytes disables it and redirects to S3.
+# Each worker process tracks and evicts against its own budget, so N workers sharing
+# IMAGE_MIRROR_DIR can use up to N times this much disk
+IMAGE_MIRROR_MAX_BYTES = int(os.environ.get('IMAGE_MIRROR_MAX_BYTES', 0))
+image_mirror = None
+if IMAGE_MIRROR_MAX_BYTES > 0:
+    image_mirror = OriginalMirror(
+        os.environ.get('IMAGE_MIRROR_DIR', 'image_mirror'),
+        http_session,
+        max_bytes=IMAGE_MIRROR_MAX_BYTES,
+    )
+# nginx internal location mapped to the mirror directory, e.g. /_mirror/; hands serving to X-Accel-Redirect
+IMAGE_ACCEL_REDIRECT_PREFIX = os.environ.get('IMAGE_ACCEL_REDIRECT_PREFIX', '')
+IMAGE_MIRROR_MAX_AGE = 24 * 3600
+
+# Background workers for /jobs/scrape, so slow upstream fetches never hold a web worker
+scrape_jobs = JobQueue(
+    workers=int(os.environ.get('SCRAPE_JOB_WORKERS', 4)),
+    max_queued=int(os.environ.get('SCRAPE_JOB_MAX_QUEUED', 1000)),
+    result_ttl=float(os.environ.get('SCRAPE_JOB_RESULT_TTL', 600)),
+)
+# Longest a client may block on GET /jobs/<id>?wait=N
+JOB_MAX_WAIT = float(os.environ.get('SCRAPE_JOB_MAX_WAIT', 30))
+
+# Concurrent lookups of the same cert share a single disk read / upstream fetch
+inflight_scrapes = SingleFlight()
+
+# Prometheus metrics served from /metrics
+metrics = MetricsRegistry()
+# Every field a card page can fill in, for the per-field 'N/A' counter
+CARD_FIELDS = ('player_name', 'set_name', 'subset', 'variation', 'tag_score', 'grade', 'grade_name')
+scrape_phase_seconds = metrics.histogram(
+    'tag_scrape_phase_seconds',
+    'Seconds spent in each phase of an upstream card scrape '
+    '(queue_wait, connect, ttfb, download, render, parse, extraction).',
+    ['phase'],
+)
+scrape_seconds = metrics.histogram('tag_scrape_seconds', 'End-to-end card lookup latency in seconds.')
+scrape_lookups = metrics.counter(
+    'tag_scrape_lookups_total',
+    'Card lookups by where the answer came from (memory, negative, disk, upstream, stale, invalid).',
+    ['source'],
+)
+upstream_outcomes = metrics.counter(
+    'tag_scrape_upstream_total', 'Upstream card page fetches by tier and outcome.', ['tier', 'outcome'],
+)
+missing_field_total = metrics.counter(
+    'tag_scrape_missing_field_total', "Scraped card pages that yielded 'N/A' for a field.", ['field'],
+)
+parsers.phase_observer = lambda phase, seconds: scrape_phase_seconds.observe(seconds, phase=phase)
+
+def lookup_hit_ratio():
+    """Share of lookups answered without going to the upstream."""
+    counts = {source: count for (source,), count in scrape_lookups.values().items()}
+    total = sum(count for source, count in counts.items() if source != 'invalid')
+    hits = sum(counts.get(source, 0) for source in ('memory', 'negative', 'disk'))
+    return (hits / total) if total else 0.0
+
+metrics.callback('tag_scrape_cache_hit_ratio', 'Share of card lookups served from a cache.', lookup_hit_ratio)
+metrics.callback(
+    'tag_card_cache_hit_ratio', 'Hit ratio of each in-memory card cache.',
+    lambda: {('memory',): card_cache.stats()['hit_ratio'], ('negative',): negative_cache.stats()['hit_ratio']},
+    ['cache'],
+)
+metrics.callback(
+    'tag_card_cache_entries', 'Entries held by each in-memory card cache.',
+    lambda: {('memory',): card_cache.stats()['entries'], ('negative',): negative_cache.stats()['entries']},
+    ['cache'],
+)
+metrics.callback(
+    'tag_scrape_coalesced_total', 'Lookups that waited for an identical in-flight lookup.',
+    lambda: inflight_scrapes.stats()['coalesced'], kind='counter',
+)
+upstream_tls = http_session.get_adapter(TAG_CARD_URL).ssl_context
+metrics.callback(
+    'tag_upstream_tls_handshakes_total', 'TLS handshakes with the upstream, by whether a session was resumed.',
+    lambda: {('true',): upstream_tls.resumed, ('false',): upstream_tls.handshakes - upstream_tls.resumed},
+    ['resumed'], kind='counter',
+)
+metrics.callback('tag_upstream_rate', 'Current upstream request rate limit per second.', lambda: rate_limiter.rate)
+metrics.callback(
+    'tag_upstream_circuit_open', '1 while the upstream circuit breaker refuses calls.',
+    lambda: int(upstream_breaker.state != CircuitBreaker.CLOSED),
+)
+metrics.callback('tag_scrape_jobs_queued', 'Scrape jobs waiting for a worker.', lambda: scrape_jobs.stats()['queue_depth'])
 
 def scrape_card_data(cert_number):
     """
-    Scrapes a single TAG Grading card page for key information using user-provided logic.
+    Returns card data for a cert number, served from the in-memory cache or the
+    on-disk cache when fresh. Failed lookups are never cached.
     """
-    url = f"https://my.taggrading.com/card/{cert_number}"
+    started = time.perf_counter()
+    cert_number = normalize_cert(cert_number)
+    if not is_valid_cert(cert_number):
+        logging.warning(f"Rejected malformed cert number {cert_number!r}")
+        scrape_lookups.inc(source='invalid')
+        return {"error": INVALID_CERT_ERROR}
+
+    cached = card_cache.get(cert_number)
+    if cached is not None:
+        logging.info(f"Cache hit for {cert_number}")
+        scrape_lookups.inc(source='memory')
+        scrape_seconds.observe(time.perf_counter() - started)
+        return cached
+    missing = negative_cache.get(cert_number)
+    if missing is not None:
+        logging.info(f"Negative cache hit for {cert_number}")
+        scrape_lookups.inc(source='negative')
+        scrape_seconds.observe(time.perf_counter() - started)
+        return missing
+
+    data = inflight_scrapes.do(cert_number, load_card_data, cert_number)
+    scrape_seconds.observe(time.perf_counter() - started)
+    # Coalesced callers all receive the leader's dict, so each gets its own copy
+    return dict(data)
+
+def load_card_data(cert_number):
+    """
+    Loads card data from the on-disk cache when fresh, otherwise from upstream,
+    and stores successful results in the in-memory cache.
+    """
+    stored = disk_cache.get(cert_number) if disk_cache is not None else None
+    if stored is not None and disk_cache.is_fresh(stored):
+        logging.info(f"Disk cache hit for {cert_number}")
+        scrape_lookups.inc(source='disk')
+        card_cache.set(cert_number, stored.data)
+        return stored.data
+
+    data = fetch_card_data(cert_number, stored)
+    if 'error' not in data:
+        missing = missing_fields(data)
+        if missing and data.get('tier') != 'rendered' and renderer_pool is not None:
+            logging.info(f"{cert_number} is missing {missing} over plain HTTP, escalating to the rendered tier")
+            rendered = render_card_data(cert_number)
+            if 'error' not in rendered and len(missing_fields(rendered)) < len(missing):
+                if disk_cache is not None:
+                    # fetch_card_data never stores an empty page, so there may be no row to update
+                    if is_empty_card(data):
+                        disk_cache.set(cert_number, rendered)
+                    else:
+                        disk_cache.update_data(cert_number, rendered)
+                data = rendered
+            elif 'error' in rendered and is_empty_card(data):
+                # Without the rendered page an empty one can't be told apart from a missing card
+                data = rendered
+
+    if 'error' not in data and is_empty_card(data):
+        if stored is None:
+            # The upstream app answers 200 for any cert, so a page without a single required field means no card
+            logging.info(f"Upstream page for {cert_number} has none of {REQUIRED_FIELDS}, treating it as not found")
+            scrape_lookups.inc(source='upstream')
+            data = {"error": NOT_FOUND_ERROR}
+            negative_cache.set(cert_number, data)
+            return data
+        # A card we have seen before doesn't vanish; more likely a maintenance or error page
+        data = {"error": f"Upstream page has none of {REQUIRED_FIELDS}"}
+
+    if 'error' in data:
+        if stored is not None:
+            # A stale copy beats an error while the upstream is failing or the circuit is open
+            logging.warning(f"Serving stale stored copy of {cert_number}: {data['error']}")
+            scrape_lookups.inc(source='stale')
+            return stored.data
+        scrape_lookups.inc(source='upstream')
+        return data
+    scrape_lookups.inc(source='upstream')
+
+    with tier_counts_lock:
+        tier_counts[data.get('tier', 'http')] += 1
+    card_cache.set(cert_number, data)
+    return data
+
+def missing_fields(data):
+    """Required fields that the extraction could not fill in."""
+    return [field for field in REQUIRED_FIELDS if data.get(field, 'N/A') == 'N/A']
+
+def is_empty_card(data):
+    """True when extraction filled in none of the required fields."""
+    return bool(REQUIRED_FIELDS) and len(missing_fields(data)) == len(REQUIRED_FIELDS)
+
+def count_missing_fields(data):
+    for field in CARD_FIELDS:
+        if data.get(field, 'N/A') == 'N/A':
+            missing_field_total.inc(field=field)
+
+def fetch_card_data(cert_number, stored=None):
+    """
+    Fetches a single TAG Grading card page and extracts its key information.
+    When a stored copy is passed its validators are sent with the request, and a
+    304 Not Modified reuses the stored fields without downloading or parsing the page.
+    """
+    url = f"{TAG_CARD_URL}{cert_number}"
     logging.info(f"Attempting to scrape URL: {url}")
 
+    headers = {}
+    if stored is not None:
+        if stored.etag:
+            headers['If-None-Match'] = stored.etag
+        if stored.last_modified:
+            headers['If-Modified-Since'] = stored.last_modified
+
     try:
-        response = requests.get(url, timeout=10)
+        response = upstream_get(url, headers)
         response.raise_for_status()
-        logging.info(f"Successfully fetched page for W1200368")
+        logging.info(f"Successfully fetched page for {cert_number}")
+    except requests.exceptions.HTTPError as e:
+        if e.response is not None and e.response.status_code in (404, 410):
+            logging.info(f"Upstream has no card {cert_number}")
+            upstream_outcomes.inc(tier='http', outcome='not_found')
+            data = {"error": NOT_FOUND_ERROR}
+            negative_cache.set(cert_number, data)
+            return data
+        logging.error(f"Error fetching page for {cert_number}: {e}")
+        upstream_outcomes.inc(tier='http', outcome='http_error')
+        return {"error": "Failed to fetch card data. Please check the cert number or URL."}
+    except CircuitOpen:
+        logging.warning(f"Upstream circuit is open, not fetching {cert_number}")
+        upstream_outcomes.inc(tier='http', outcome='circuit_open')
+        return {"error": "TAG Grading is temporarily unavailable. Please try again shortly."}
     except requests.exceptions.RequestException as e:
         logging.error(f"Error fetching page for {cert_number}: {e}")
+        upstream_outcomes.inc(tier='http', outcome=request_error_outcome(e))
         return {"error": "Failed to fetch card data. Please check the cert number or URL."}
 
-    soup = BeautifulSoup(response.text, 'html.parser')
-    data = {}
-    
-    # --- Scrape using parent and replace for robust text handling ---
-    try:
-        player_label = soup.find("span", string="Player name:")
-        if player_label:
-            data['player_name'] = player_label.find_next_sibling('span').get_text(strip=True)
-        else:
-            data['player_name'] = 'N/A'
-            logging.warning("Player name not found.")
-    except AttributeError:
-        data['player_name'] = 'N/A'
-        logging.warning("Player name data not found.")
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+    if response.status_code == 304 and stored is not None:
+        logging.info(f"{cert_number} not modified upstream, reusing stored copy")
+        upstream_outcomes.inc(tier='http', outcome='not_modified')
+        disk_cache.touch(cert_number, etag, last_modified)
+        return stored.data
+
+    data = extract_card_data(response.text, cert_number, 'http')
+    # An empty page is either a missing card or an upstream hiccup; never let it replace a stored card
+    if 'error' not in data and not is_empty_card(data) and disk_cache is not None:
+        disk_cache.set(cert_number, data, etag, last_modified)
+    return data
 
+def extract_card_data(html, cert_number, tier):
+    """Runs the configured extraction engine on a fetched page, turning a parser crash into an error."""
     try:
-        set_name_label = soup.find("span", string="Set name:")
-        if set_name_label:
-            set_name_full_text = set_name_label.parent.get_text(strip=True)
-            data['set_name'] = set_name_full_text.replace("Set name:", "").strip()
-        else:
-            data['set_name'] = 'N/A'
-            logging.warning("Set name not found.")
-    except AttributeError:
-        data['set_name'] = 'N/A'
-        logging.warning("Set name data not found.")
-        
+        data = parse_card_html(html)
+    except Exception:
+        logging.exception(f"Could not extract card data for {cert_number} from the {tier} page")
+        upstream_outcomes.inc(tier=tier, outcome='parse_error')
+        return {"error": "Failed to read card data from the TAG Grading page."}
+    data['tier'] = tier
+    upstream_outcomes.inc(tier=tier, outcome='success')
+    count_missing_fields(data)
+    return data
+
+def request_error_outcome(error):
+    """Outcome label for a failed upstream request."""
+    if isinstance(error, UpstreamThrottled):
+        return 'throttled'
+    if isinstance(error, requests.exceptions.Timeout):
+        return 'timeout'
+    if isinstance(error, requests.exceptions.ConnectionError):
+        return 'connection_error'
+    return 'error'
+
+def upstream_get(url, headers=None):
+    """
+    GETs an upstream URL through the shared rate limiter. A throttled (429/503)
+    response is retried once, after the limiter has backed off.
+    """
+    for attempt in range(2):
+        if not upstream_breaker.allow():
+            raise CircuitOpen("Upstream circuit is open")
+        waited = rate_limiter.acquire(max_wait=UPSTREAM_MAX_QUEUE_WAIT)
+        if waited is None:
+            raise UpstreamThrottled(f"Rate limiter queue is longer than {UPSTREAM_MAX_QUEUE_WAIT}s")
+        scrape_phase_seconds.observe(waited, phase='queue_wait')
+        take_connect_seconds()
+        started = time.monotonic()
+        try:
+            response = http_session.get(url, headers=headers, timeout=UPSTREAM_TIMEOUT)
+        except requests.exceptions.RequestException:
+            upstream_breaker.record(False, time.monotonic() - started)
+            raise
+        elapsed = time.monotonic() - started
+        upstream_breaker.record(response.status_code < 500, elapsed)
+        # response.elapsed runs until the headers were parsed, i.e. connect plus time to first byte
+        connect = take_connect_seconds()
+        headers_at = response.elapsed.total_seconds()
+        scrape_phase_seconds.observe(connect, phase='connect')
+        scrape_phase_seconds.observe(max(0.0, headers_at - connect), phase='ttfb')
+        scrape_phase_seconds.observe(max(0.0, elapsed - headers_at), phase='download')
+        rate_limiter.on_response(response.status_code, response.headers.get('Retry-After'))
+        if response.status_code not in rate_limiter.THROTTLE_STATUSES:
+            break
+    return response
+
+def render_card_data(cert_number):
+    """
+    Loads a card page in a pooled headless browser and extracts its key information
+    from the rendered DOM.
+    """
+    if renderer_pool is None:
+        return {"error": "Rendered scraping is not enabled on this server."}
+
+    url = f"{TAG_CARD_URL}{normalize_cert(cert_number)}"
+    logging.info(f"Attempting to render URL: {url}")
     try:
-        subset_label = soup.find("span", string="Subset:")
-        if subset_label:
-            subset_full_text = subset_label.parent.get_text(strip=True)
-            subset_val = subset_full_text.replace("Subset:", "").strip()
-            data['subset'] = subset_val if subset_val and subset_val != '-' else 'N/A'
+        if not upstream_breaker.allow():
+            raise CircuitOpen("Upstream circuit is open")
+        waited = rate_limiter.acquire(max_wait=UPSTREAM_MAX_QUEUE_WAIT)
+        if waited is None:
+            raise UpstreamThrottled(f"Rate limiter queue is longer than {UPSTREAM_MAX_QUEUE_WAIT}s")
+        scrape_phase_seconds.observe(waited, phase='queue_wait')
+        started = time.monotonic()
+        try:
+            html = renderer_pool.render(url)
+        except Exception:
+            upstream_breaker.record(False, time.monotonic() - started)
+            raise
+        upstream_breaker.record(True, time.monotonic() - started)
+        scrape_phase_seconds.observe(time.monotonic() - started, phase='render')
+    except Exception as e:
+        logging.error(f"Error rendering page for {cert_number}: {e}")
+        if isinstance(e, CircuitOpen):
+            outcome = 'circuit_open'
+        elif isinstance(e, requests.exceptions.RequestException):
+            outcome = request_error_outcome(e)
         else:
-            data['subset'] = 'N/A'
-            logging.warning("Subset not found.")
-    except AttributeError:
-        data['subset'] = 'N/A'
-        logging.warning("Subset data not found.")
+            outcome = 'timeout' if isinstance(e, TimeoutError) else 'error'
+        upstream_outcomes.inc(tier='rendered', outcome=outcome)
+        return {"error": "Failed to render card data. Please check the cert number or URL."}
+    return extract_card_data(html, cert_number, 'rendered')
 
+def iter_scrape_cards(cert_numbers, max_workers=BATCH_MAX_WORKERS):
+    """
+    Scrapes several cert numbers concurrently, with at most max_workers fetches in flight,
+    and yields (cert_number, data) pairs in the order the lookups finish.
+    Lookups that have not started are cancelled if the caller stops iterating.
+    """
+    # Drop duplicates but keep the caller's order for submission
+    cert_numbers = list(dict.fromkeys(cert_numbers))
+    if not cert_numbers:
+        return
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(cert_numbers))))
     try:
-        variation_label = soup.find("span", string="Variation:")
-        if variation_label:
-            variation_full_text = variation_label.parent.get_text(strip=True)
-            variation_val = variation_full_text.replace("Variation:", "").strip()
-            data['variation'] = variation_val if variation_val and variation_val != '-' else 'N/A'
+        futures = {executor.submit(scrape_card_data, cert): cert for cert in cert_numbers}
+        for future in as_completed(futures):
+            cert = futures[future]
+            try:
+                data = future.result()
+            except Exception as e:
+                logging.exception(f"Unexpected error scraping {cert}")
+                data = {"error": str(e)}
+            yield cert, data
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def scrape_cards(cert_numbers, max_workers=BATCH_MAX_WORKERS):
+    """
+    Scrapes several cert numbers concurrently, with at most max_workers fetches in flight.
+    Returns a (results, errors) pair of dicts keyed by cert number.
+    """
+    cert_numbers = list(dict.fromkeys(cert_numbers))
+    results, errors = {}, {}
+    for cert, data in iter_scrape_cards(cert_numbers, max_workers):
+        if 'error' in data:
+            errors[cert] = data['error']
         else:
-            data['variation'] = 'N/A'
-            logging.warning("Variation not found.")
-    except AttributeError:
-        data['variation'] = 'N/A'
-        logging.warning("Variation data not found.")
-
-    # --- Find TAG Score, Grade, and Grade Name ---
-    # Re-using a previous, reliable method
-    try:
-        tag_score_div = soup.find('div', string=re.compile(r'TAG Score', re.I))
-        if tag_score_div:
-            parent_div = tag_score_div.find_parent('div')
-            score_div = parent_div.find_previous_sibling('div').find('div')
-            data['tag_score'] = score_div.get_text(strip=True)
-
-            grade_container = parent_div.find_next_sibling('div')
-            data['grade'] = grade_container.find('div').get_text(strip=True)
-            data['grade_name'] = grade_container.find_all('div')[-1].get_text(strip=True)
-    except (AttributeError, IndexError):
-        logging.warning("TAG Score or Grade data not found.")
-        data['tag_score'] = 'N/A'
-        data['grade'] = 'N/A'
-        data['grade_name'] = 'N/A'
-
-    logging.info(f"Finished scraping. Data collected: {data}")
-    return data
+            results[cert] = data
+
+    ordered_results = {cert: results[cert] for cert in cert_numbers if cert in results}
+    ordered_errors = {cert: errors[cert] for cert in cert_numbers if cert in errors}
+    return ordered_results, ordered_errors
+
+def sse_event(event, data):
+    """Formats one Server-Sent Events message with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+# Shared secret sent as X-Admin-Token to unlock admin-only diagnostics; empty disables them
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+
+def is_admin_request():
+    token = request.headers.get('X-Admin-Token', '')
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+# Where on-demand request profiles go; when unset the profiling hooks are not even registered
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '')
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get('PROFILE_SAMPLE_INTERVAL', 0.001))
+
+if PROFILE_DIR:
+    @app.before_request
+    def start_request_profile():
+        """Profiles this request when an admin sends X-Profile: 1 or ?profile=1."""
+        flag = request.headers.get('X-Profile') or request.args.get('profile') or ''
+        if flag.lower() not in ('1', 'true', 'yes'):
+            return
+        if not is_admin_request():
+            logging.warning(f"Ignoring profile request for {request.path} without a valid admin token")
+            return
+        profile = RequestProfile(PROFILE_DIR, f"{request.method} {request.path}", PROFILE_SAMPLE_INTERVAL)
+        if profile.start():
+            g.request_profile = profile
+
+    @app.after_request
+    def finish_request_profile(response):
+        profile = g.pop('request_profile', None)
+        if profile is not None:
+            response.headers['X-Profile-Id'] = profile.stop()
+        return response
+
+    @app.teardown_request
+    def abandon_request_profile(error=None):
+        # after_request is skipped when a request dies mid-way; never leave the profiler running
+        profile = g.pop('request_profile', None)
+        if profile is not None:
+            profile.stop()
+
+# Always-on stack sampler; SAMPLER_INTERVAL=0 turns it off
+SAMPLER_INTERVAL = float(os.environ.get('SAMPLER_INTERVAL', 0.01))
+stack_sampler = None
+if SAMPLER_INTERVAL > 0:
+    stack_sampler = RollingStackSampler(
+        interval=SAMPLER_INTERVAL,
+        window=float(os.environ.get('SAMPLER_WINDOW', 300)),
+    )
+    stack_sampler.ensure_running()
+    # Forked workers (gunicorn --preload) don't inherit the parent's thread, so check on each request
+    app.before_request(stack_sampler.ensure_running)
 
 @app.route('/')
 def index():
@@ -110,11 +561,216 @@ def scrape():
     if not cert_number:
         logging.error("No cert number provided in the request.")
         return jsonify({"error": "No cert number provided."}), 400
+    if not is_valid_cert(cert_number):
+        return jsonify({"error": INVALID_CERT_ERROR}), 400
     
-    scraped_data = scrape_card_data(cert_number)
+    if request.json.get('render'):
+        scraped_data = render_card_data(cert_number)
+    else:
+        scraped_data = scrape_card_data(cert_number)
     return jsonify(scraped_data)
 
+@app.route('/scrape/batch', methods=['POST'])
+def scrape_batch():
+    payload = request.get_json(silent=True) or {}
+    cert_numbers = payload.get('cert_numbers')
+    if not isinstance(cert_numbers, list) or not cert_numbers:
+        logging.error("No cert numbers provided in the batch request.")
+        return jsonify({"error": "Provide a non-empty list of cert numbers."}), 400
+
+    cert_numbers = [str(cert).strip() for cert in cert_numbers if str(cert).strip()]
+    if not cert_numbers:
+        return jsonify({"error": "Provide a non-empty list of cert numbers."}), 400
+    if len(cert_numbers) > BATCH_MAX_CERTS:
+        return jsonify({"error": f"At most {BATCH_MAX_CERTS} cert numbers per batch."}), 400
+
+    try:
+        max_workers = int(payload.get('max_workers', BATCH_MAX_WORKERS))
+    except (TypeError, ValueError):
+        return jsonify({"error": "max_workers must be an integer."}), 400
+    # Callers may ask for less concurrency, never more than the server allows
+    max_workers = max(1, min(max_workers, BATCH_MAX_WORKERS))
+
+    results, errors = scrape_cards(cert_numbers, max_workers=max_workers)
+    return jsonify({"results": results, "errors": errors})
+
+@app.route('/scrape/stream')
+def scrape_stream():
+    cert_numbers = [cert.strip() for cert in request.args.get('certs', '').split(',') if cert.strip()]
+    if not cert_numbers:
+        return jsonify({"error": "Provide cert numbers as ?certs=A1234567,B7654321."}), 400
+    if len(cert_numbers) > BATCH_MAX_CERTS:
+        return jsonify({"error": f"At most {BATCH_MAX_CERTS} cert numbers per batch."}), 400
+
+    def generate():
+        started = time.monotonic()
+        succeeded = failed = 0
+        for cert, data in iter_scrape_cards(cert_numbers):
+            if 'error' in data:
+                failed += 1
+                # Not 'error': EventSource fires that name itself when the connection fails
+                yield sse_event('cert_error', {"cert_number": cert, "error": data['error']})
+            else:
+                succeeded += 1
+                yield sse_event('result', {"cert_number": cert, "data": data})
+        yield sse_event('summary', {
+            "total": succeeded + failed,
+            "succeeded": succeeded,
+            "failed": failed,
+            "elapsed": time.monotonic() - started,
+        })
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=headers)
+
+@app.route('/images/<cert_number>/<int:width>.<ext>')
+def slab_thumbnail(cert_number, width, ext):
+    if not is_valid_cert(cert_number) or width not in THUMBNAIL_WIDTHS or ext not in THUMBNAIL_FORMATS:
+        abort(404)
+    try:
+        path, digest = thumbnail_store.thumbnail(cert_number, width, ext)
+    except ImageNotFound:
+        abort(404)
+    except (requests.exceptions.RequestException, OSError) as e:
+        logging.error(f"Could not build thumbnail for {cert_number}: {e}")
+        abort(502)
+
+    response = send_file(
+        path,
+        mimetype=THUMBNAIL_FORMATS[ext][1],
+        etag=f"{digest[:32]}-{width}",
+        max_age=THUMBNAIL_MAX_AGE,
+        conditional=True,
+    )
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+@app.route('/images/<cert_number>/original.jpg')
+def slab_original(cert_number):
+    if not is_valid_cert(cert_number):
+        abort(404)
+    cert_number = normalize_cert(cert_number)
+    if image_mirror is None:
+        return redirect(SLAB_IMAGE_URL.format(cert=cert_number))
+    try:
+        path = image_mirror.path(cert_number)
+    except ImageNotFound:
+        abort(404)
+    except (requests.exceptions.RequestException, OSError) as e:
+        logging.error(f"Could not mirror slab image for {cert_number}: {e}")
+        return redirect(SLAB_IMAGE_URL.format(cert=cert_number))
+
+    try:
+        stat = os.stat(path)
+        etag = f"{cert_number}-{stat.st_size}-{stat.st_mtime_ns}"
+        if IMAGE_ACCEL_REDIRECT_PREFIX:
+            # nginx serves the file itself, including Range and conditional requests
+            response = Response(mimetype='image/jpeg')
+            response.headers['X-Accel-Redirect'] = IMAGE_ACCEL_REDIRECT_PREFIX + os.path.basename(path)
+            response.set_etag(etag)
+        else:
+            # conditional=True answers Range and If-None-Match; the body goes out through the
+            # server's wsgi.file_wrapper (sendfile under gunicorn) or X-Sendfile when enabled
+            response = send_file(path, mimetype='image/jpeg', etag=etag, conditional=True)
+    except FileNotFoundError:
+        # A concurrent download evicted the file after path() returned it
+        logging.warning(f"Mirrored slab image for {cert_number} was evicted while serving it")
+        return redirect(SLAB_IMAGE_URL.format(cert=cert_number))
+    response.cache_control.public = True
+    response.cache_control.max_age = IMAGE_MIRROR_MAX_AGE
+    return response
+
+@app.template_global()
+def thumbnail_src(cert_number, ext='jpg'):
+    """src of a slab image for browsers without srcset: its smallest configured thumbnail."""
+    return url_for('slab_thumbnail', cert_number=cert_number, width=min(THUMBNAIL_WIDTHS), ext=ext)
+
+@app.template_global()
+def thumbnail_srcset(cert_number, ext):
+    """srcset attribute value listing every thumbnail width of a slab image."""
+    return ', '.join(
+        f"{url_for('slab_thumbnail', cert_number=cert_number, width=width, ext=ext)} {width}w"
+        for width in THUMBNAIL_WIDTHS
+    )
+
+@app.route('/jobs/scrape', methods=['POST'])
+def submit_scrape_job():
+    payload = request.get_json(silent=True) or {}
+    cert_number = payload.get('cert_number')
+    if not cert_number:
+        logging.error("No cert number provided in the job request.")
+        return jsonify({"error": "No cert number provided."}), 400
+    if not is_valid_cert(cert_number):
+        return jsonify({"error": INVALID_CERT_ERROR}), 400
+
+    try:
+        job = scrape_jobs.submit(scrape_card_data, cert_number)
+    except QueueFull:
+        logging.warning("Scrape job queue is full, rejecting request.")
+        return jsonify({"error": "Too many lookups queued. Please try again shortly."}), 503, {'Retry-After': '5'}
+
+    status_url = url_for('scrape_job_status', job_id=job.id)
+    return jsonify({"job_id": job.id, "status": job.status, "status_url": status_url}), 202, {'Location': status_url}
+
+@app.route('/jobs/<job_id>')
+def scrape_job_status(job_id):
+    try:
+        wait = min(float(request.args.get('wait', 0)), JOB_MAX_WAIT)
+    except ValueError:
+        return jsonify({"error": "wait must be a number of seconds."}), 400
+
+    job = scrape_jobs.wait(job_id, wait) if wait > 0 else scrape_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired job id."}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/stats')
+def scrape_job_stats():
+    return jsonify(scrape_jobs.stats())
+
+@app.route('/admin/profile/stacks')
+def sampled_stacks():
+    """Collapsed stacks from the always-on sampler over the last ?seconds= (default: whole window)."""
+    if not is_admin_request():
+        abort(403)
+    if stack_sampler is None:
+        return jsonify({"error": "The sampling profiler is disabled on this server."}), 404
+    seconds = request.args.get('seconds', type=float)
+    return Response(format_collapsed(stack_sampler.snapshot(seconds)), mimetype='text/plain')
+
+@app.route('/admin/profile/stats')
+def sampler_stats():
+    if not is_admin_request():
+        abort(403)
+    if stack_sampler is None:
+        return jsonify({"error": "The sampling profiler is disabled on this server."}), 404
+    return jsonify(stack_sampler.stats())
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+@app.route('/scrape/cache')
+def scrape_cache_stats():
+    with tier_counts_lock:
+        tiers = dict(tier_counts)
+    stats = {
+        "memory": card_cache.stats(),
+        "negative": negative_cache.stats(),
+        "singleflight": inflight_scrapes.stats(),
+        "tiers": tiers,
+        "rate_limiter": rate_limiter.stats(),
+        "breaker": upstream_breaker.stats(),
+    }
+    if image_mirror is not None:
+        stats["image_mirror"] = image_mirror.stats()
+    if disk_cache is not None:
+        stats["disk"] = disk_cache.stats()
+    if renderer_pool is not None:
+        stats["renderer"] = renderer_pool.stats()
+    return jsonify(stats)
+
 if __name__ == '__main__':
-    import os
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=True)
\ No newline at end of file
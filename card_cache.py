@@ -0,0 +1,194 @@
+"""
+Caches for scraped TAG card data.
+"""
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict, namedtuple
+
+
+# TAG cert numbers are one letter followed by seven digits, e.g. W1200368
+# (ASCII only: \d and str.upper() would otherwise accept digits and letters from other scripts)
+CERT_NUMBER_PATTERN = re.compile(os.environ.get('CERT_NUMBER_PATTERN', r'[A-Z][0-9]{7}'), re.ASCII)
+
+
+def normalize_cert(cert_number):
+    """Canonical form of a cert number, used as the cache key and in upstream URLs."""
+    return str(cert_number).strip().upper()
+
+
+def is_valid_cert(cert_number):
+    """True when a cert number has the shape of a TAG cert, so it is worth asking the upstream about."""
+    return CERT_NUMBER_PATTERN.fullmatch(normalize_cert(cert_number)) is not None
+
+
+class MemoryCardCache:
+    """
+    Thread-safe in-process cache of scraped card dicts.
+
+    Entries expire ttl seconds after they are stored. When either max_entries or
+    max_bytes (estimated from the JSON size of each entry) is exceeded, the least
+    recently used entries are evicted first.
+    """
+
+    def __init__(self, ttl=86400, max_entries=10000, max_bytes=32 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (expires_at, size, data)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, cert_number):
+        key = normalize_cert(cert_number)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, size, data = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        # Hand out a copy so callers can't mutate the cached entry
+        return dict(data)
+
+    def set(self, cert_number, data, ttl=None):
+        key = normalize_cert(cert_number)
+        data = dict(data)
+        size = len(json.dumps(data))
+        if size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires_at, size, data)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, cert_number):
+        with self._lock:
+            self._remove(normalize_cert(cert_number))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+            }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+
+# A card as persisted on disk, with the upstream validators needed to revalidate it
+StoredCard = namedtuple('StoredCard', ['data', 'etag', 'last_modified', 'fetched_at'])
+
+
+class SqliteCardCache:
+    """
+    Persistent card cache in a SQLite database running in WAL mode.
+
+    Each row keeps the extracted fields alongside the upstream ETag and
+    Last-Modified headers so stale entries can be refreshed with a conditional
+    GET. Connections are opened per thread and per process, and SQLite's own
+    locking makes the file safe to share between worker processes on one host.
+    """
+
+    def __init__(self, path, ttl=86400, busy_timeout=5.0):
+        self.path = path
+        self.ttl = ttl
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cards ("
+            " cert_number TEXT PRIMARY KEY,"
+            " data TEXT NOT NULL,"
+            " etag TEXT,"
+            " last_modified TEXT,"
+            " fetched_at REAL NOT NULL)"
+        )
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        # A connection inherited across fork() must not be reused by the child
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, cert_number):
+        row = self._connect().execute(
+            "SELECT data, etag, last_modified, fetched_at FROM cards WHERE cert_number = ?",
+            (normalize_cert(cert_number),),
+        ).fetchone()
+        if row is None:
+            return None
+        return StoredCard(json.loads(row[0]), row[1], row[2], row[3])
+
+    def is_fresh(self, stored):
+        return time.time() - stored.fetched_at < self.ttl
+
+    def set(self, cert_number, data, etag=None, last_modified=None):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO cards (cert_number, data, etag, last_modified, fetched_at)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (normalize_cert(cert_number), json.dumps(data), etag, last_modified, time.time()),
+        )
+
+    def update_data(self, cert_number, data):
+        """Replaces the stored fields of an entry but keeps its validators, e.g. after a rendered re-scrape."""
+        self._connect().execute(
+            "UPDATE cards SET data = ? WHERE cert_number = ?",
+            (json.dumps(data), normalize_cert(cert_number)),
+        )
+
+    def touch(self, cert_number, etag=None, last_modified=None):
+        """Marks an entry as freshly revalidated, e.g. after a 304 Not Modified."""
+        self._connect().execute(
+            "UPDATE cards SET fetched_at = ?,"
+            " etag = COALESCE(?, etag), last_modified = COALESCE(?, last_modified)"
+            " WHERE cert_number = ?",
+            (time.time(), etag, last_modified, normalize_cert(cert_number)),
+        )
+
+    def invalidate(self, cert_number):
+        self._connect().execute(
+            "DELETE FROM cards WHERE cert_number = ?", (normalize_cert(cert_number),)
+        )
+
+    def stats(self):
+        count = self._connect().execute("SELECT COUNT(*) FROM cards").fetchone()[0]
+        return {"entries": count, "path": self.path}
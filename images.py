@@ -0,0 +1,217 @@
+"""
+Local slab image pipeline: fetch each slab image once, keep resized thumbnails
+and a bounded mirror of the originals on disk.
+"""
+import os
+import io
+import contextlib
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+from card_cache import normalize_cert
+from upstream import SingleFlight
+
+SLAB_IMAGE_URL = os.environ.get(
+    'SLAB_IMAGE_URL',
+    'https://devblock-tag.s3.us-west-2.amazonaws.com/slab-images/{cert}_Slabbed_FRONT.jpg',
+)
+
+# Output formats: file extension -> (Pillow format, mimetype)
+THUMBNAIL_FORMATS = {
+    'webp': ('WEBP', 'image/webp'),
+    'jpg': ('JPEG', 'image/jpeg'),
+}
+
+
+class ImageNotFound(Exception):
+    """Raised when the image host has no slab image for a cert."""
+
+
+def write_atomic(path, data):
+    """Writes bytes to path via a temporary file and rename, so readers never see a partial file."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class ThumbnailStore:
+    """
+    Content-addressed on-disk store of slab image thumbnails.
+
+    The first request for a cert downloads the original once, names it by the
+    SHA-256 of its bytes and renders every configured width in every format.
+    Later requests are plain file lookups. Layout under root:
+    certs/<cert> holds the digest, thumbs/<digest>_<width>.<ext> the thumbnails.
+    """
+
+    def __init__(self, root, session, source_url=SLAB_IMAGE_URL, widths=(240, 480, 720),
+                 jpeg_quality=82, webp_quality=80, timeout=10):
+        self.root = root
+        self.session = session
+        self.source_url = source_url
+        self.widths = tuple(sorted(widths))
+        self.jpeg_quality = jpeg_quality
+        self.webp_quality = webp_quality
+        self.timeout = timeout
+        self._certs_dir = os.path.join(root, 'certs')
+        self._thumbs_dir = os.path.join(root, 'thumbs')
+        os.makedirs(self._certs_dir, exist_ok=True)
+        os.makedirs(self._thumbs_dir, exist_ok=True)
+        self._inflight = SingleFlight()
+        self.fetched = 0
+
+    def thumbnail(self, cert_number, width, ext):
+        """
+        Returns (path, digest) of a thumbnail, fetching and rendering the slab image
+        on first use. Raises ImageNotFound, or requests' exceptions on fetch errors.
+        """
+        cert_number = normalize_cert(cert_number)
+        if width not in self.widths or ext not in THUMBNAIL_FORMATS:
+            raise ValueError(f"Unsupported thumbnail {width}.{ext}")
+
+        digest = self._digest(cert_number)
+        if digest is None:
+            digest = self._inflight.do(cert_number, self._fetch, cert_number)
+        path = self._thumb_path(digest, width, ext)
+        if not os.path.exists(path):
+            # Thumbnail files were removed by hand; the cert mapping is stale
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(os.path.join(self._certs_dir, cert_number))
+            digest = self._inflight.do(cert_number, self._fetch, cert_number)
+            path = self._thumb_path(digest, width, ext)
+        return path, digest
+
+    def _digest(self, cert_number):
+        try:
+            with open(os.path.join(self._certs_dir, cert_number)) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def _thumb_path(self, digest, width, ext):
+        return os.path.join(self._thumbs_dir, f"{digest}_{width}.{ext}")
+
+    def _fetch(self, cert_number):
+        url = self.source_url.format(cert=cert_number)
+        logging.info(f"Fetching slab image {url}")
+        response = self.session.get(url, timeout=self.timeout)
+        if response.status_code in (403, 404):  # S3 answers 403 for missing keys
+            raise ImageNotFound(cert_number)
+        response.raise_for_status()
+
+        original = response.content
+        digest = hashlib.sha256(original).hexdigest()
+        if not all(os.path.exists(self._thumb_path(digest, w, ext))
+                   for w in self.widths for ext in THUMBNAIL_FORMATS):
+            self._render(original, digest)
+        write_atomic(os.path.join(self._certs_dir, cert_number), digest.encode())
+        self.fetched += 1
+        return digest
+
+    def _render(self, original, digest):
+        with Image.open(io.BytesIO(original)) as image:
+            image = image.convert('RGB')
+            for width in self.widths:
+                if width < image.width:
+                    height = round(image.height * width / image.width)
+                    resized = image.resize((width, height), Image.LANCZOS)
+                else:
+                    resized = image
+                for ext, (pil_format, _) in THUMBNAIL_FORMATS.items():
+                    buffer = io.BytesIO()
+                    if pil_format == 'JPEG':
+                        resized.save(buffer, pil_format, quality=self.jpeg_quality, optimize=True, progressive=True)
+                    else:
+                        resized.save(buffer, pil_format, quality=self.webp_quality, method=4)
+                    write_atomic(self._thumb_path(digest, width, ext), buffer.getvalue())
+
+
+class OriginalMirror:
+    """
+    Bounded on-disk mirror of full-size slab images, stored as root/<cert>.jpg.
+
+    Files are never modified after they are written, so their size and mtime
+    make a stable validator. Recency is tracked in memory, seeded from file
+    mtimes at startup, and the least recently served originals are deleted
+    once the mirror grows past max_bytes. That accounting is per instance, so
+    several processes sharing root each keep up to max_bytes of their own.
+    """
+
+    def __init__(self, root, session, max_bytes, source_url=SLAB_IMAGE_URL, timeout=30):
+        self.root = root
+        self.session = session
+        self.max_bytes = max_bytes
+        self.source_url = source_url
+        self.timeout = timeout
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._inflight = SingleFlight()
+        self._lru = OrderedDict()  # cert -> size in bytes
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # Oldest files first, so a restart keeps roughly the previous eviction order
+        entries = [(e.stat(), e.name) for e in os.scandir(root)
+                   if e.name.endswith('.jpg') and not e.name.startswith('.')]
+        for stat, name in sorted(entries, key=lambda entry: entry[0].st_mtime):
+            self._lru[name[:-len('.jpg')]] = stat.st_size
+            self._bytes += stat.st_size
+
+    def path(self, cert_number):
+        """Local path of a cert's original slab image, downloading it on first use."""
+        cert_number = normalize_cert(cert_number)
+        path = os.path.join(self.root, f"{cert_number}.jpg")
+        with self._lock:
+            if cert_number in self._lru and os.path.exists(path):
+                self._lru.move_to_end(cert_number)
+                self.hits += 1
+                return path
+            self.misses += 1
+        if not os.path.exists(path):
+            self._inflight.do(cert_number, self._fetch, cert_number, path)
+        self._track(cert_number, os.path.getsize(path))
+        return path
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._lru),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _fetch(self, cert_number, path):
+        url = self.source_url.format(cert=cert_number)
+        logging.info(f"Mirroring slab image {url}")
+        response = self.session.get(url, timeout=self.timeout)
+        if response.status_code in (403, 404):
+            raise ImageNotFound(cert_number)
+        response.raise_for_status()
+        write_atomic(path, response.content)
+
+    def _track(self, cert_number, size):
+        with self._lock:
+            self._bytes += size - self._lru.pop(cert_number, 0)
+            self._lru[cert_number] = size
+            # Always keep the image just requested, even if it alone exceeds the budget
+            while self._bytes > self.max_bytes and len(self._lru) > 1:
+                evicted, evicted_size = self._lru.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(os.path.join(self.root, f"{evicted}.jpg"))
@@ -0,0 +1,170 @@
+"""
+Background job queue so slow scrapes don't hold an HTTP worker.
+"""
+import time
+import uuid
+import queue
+import logging
+import threading
+
+
+class QueueFull(Exception):
+    """Raised by JobQueue.submit when max_queued jobs are already waiting."""
+
+
+class Job:
+    QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+    def __init__(self, fn, args, kwargs):
+        self.id = uuid.uuid4().hex
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.status = self.QUEUED
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.finished = threading.Event()
+
+    def to_dict(self):
+        data = {
+            "job_id": self.id,
+            "status": self.status,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if self.status == self.DONE:
+            data["result"] = self.result
+        elif self.status == self.FAILED:
+            data["error"] = self.error
+        return data
+
+
+class JobQueue:
+    """
+    Fixed pool of worker threads draining a bounded FIFO of jobs.
+
+    Finished jobs are kept for result_ttl seconds so clients can poll for them.
+    Queue depth, time spent queued and worker utilization are reported by stats().
+    """
+
+    def __init__(self, workers=4, max_queued=1000, result_ttl=600):
+        self.workers = workers
+        self.result_ttl = result_ttl
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        self._busy = 0
+        self._busy_seconds = 0.0
+        self._started_at = None
+        self._last_prune = 0.0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def submit(self, fn, *args, **kwargs):
+        """Queues fn(*args, **kwargs) and returns its Job right away."""
+        self._ensure_started()
+        self._prune()
+        job = Job(fn, args, kwargs)
+        with self._lock:
+            self._jobs[job.id] = job
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job.id]
+                self.rejected += 1
+            raise QueueFull(f"{self._queue.maxsize} jobs are already queued")
+        with self._lock:
+            self.submitted += 1
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def wait(self, job_id, timeout=None):
+        """Blocks until the job finishes or timeout passes, then returns it (None if unknown)."""
+        job = self.get(job_id)
+        if job is not None:
+            job.finished.wait(timeout)
+        return job
+
+    def stats(self):
+        with self._lock:
+            uptime = time.monotonic() - self._started_at if self._started_at else 0.0
+            dequeued = self.completed + self.failed + self._busy
+            busy_seconds = self._busy_seconds
+            return {
+                "workers": self.workers,
+                "busy_workers": self._busy,
+                "queue_depth": self._queue.qsize(),
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "queue_wait_avg": (self.wait_total / dequeued) if dequeued else 0.0,
+                "queue_wait_max": self.wait_max,
+                "utilization": (busy_seconds / (uptime * self.workers)) if uptime else 0.0,
+            }
+
+    def _ensure_started(self):
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            self._started_at = time.monotonic()
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            started = time.monotonic()
+            job.started_at = time.time()
+            waited = job.started_at - job.submitted_at
+            with self._lock:
+                self._busy += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+            job.status = Job.RUNNING
+            try:
+                job.result = job.fn(*job.args, **job.kwargs)
+                job.status = Job.DONE
+            except Exception as e:
+                logging.exception(f"Job {job.id} failed")
+                job.error = str(e)
+                job.status = Job.FAILED
+            job.finished_at = time.time()
+            with self._lock:
+                self._busy -= 1
+                self._busy_seconds += time.monotonic() - started
+                if job.status == Job.DONE:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+            job.finished.set()
+            self._queue.task_done()
+
+    def _prune(self):
+        now = time.time()
+        cutoff = now - self.result_ttl
+        with self._lock:
+            if now - self._last_prune < 10:
+                return
+            self._last_prune = now
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.finished_at is not None and job.finished_at < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
@@ -0,0 +1,455 @@
+"""
+Extraction engines that turn a TAG Grading card page into the card data dict.
+
+The DOM engines ('soup', 'lxml', 'partial') return exactly the same dict for
+the same page, so they can be swapped freely with the CARD_PARSER setting.
+The 'embedded' engine reads the same fields from JSON state shipped in the
+page and hands over to a DOM engine when there is none.
+"""
+import re
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+from bs4 import BeautifulSoup
+
+try:
+    import lxml.etree
+    import lxml.html
+except ImportError:  # lxml is optional; the soup engine still works without it
+    lxml = None
+
+TAG_SCORE_PATTERN = re.compile(r'TAG Score', re.I)
+
+# Span labels on the card page and the data key each one fills
+SPAN_LABELS = {
+    "Player name:": 'player_name',
+    "Set name:": 'set_name',
+    "Subset:": 'subset',
+    "Variation:": 'variation',
+}
+# Span labels plus the TAG Score div
+ALL_LABELS = len(SPAN_LABELS) + 1
+
+# Field names the card data goes by in embedded JSON state, per data key
+EMBEDDED_ALIASES = {
+    'player_name': ('playerName', 'player_name', 'player'),
+    'set_name': ('setName', 'set_name', 'cardSet'),
+    'subset': ('subset', 'subSet', 'sub_set'),
+    'variation': ('variation', 'variant'),
+    'tag_score': ('tagScore', 'tag_score', 'score'),
+    'grade': ('grade', 'gradeNumber', 'grade_number'),
+    'grade_name': ('gradeName', 'grade_name', 'gradeLabel', 'gradeText'),
+}
+EMBEDDED_KEYS = {alias: key for key, aliases in EMBEDDED_ALIASES.items() for alias in aliases}
+SCRIPT_PATTERN = re.compile(r'<script\b([^>]*)>(.*?)</script\s*>', re.I | re.S)
+JSON_SCRIPT_ATTRS = re.compile(r'__NEXT_DATA__|application/(?:ld\+)?json', re.I)
+STATE_ASSIGNMENT = re.compile(r'window\.__[A-Z_]+__\s*=\s*')
+
+# How much of the page the partial parser feeds before checking whether it can stop
+PARTIAL_CHUNK_SIZE = 16 * 1024
+
+# Optional callable(phase, seconds) told how long each engine spent building its
+# document ('parse') and reading the fields out of it ('extraction')
+phase_observer = None
+
+
+# Per-thread {phase: seconds} being summed by _combined_phases(), or None
+_phase_totals = threading.local()
+
+
+def _observe(phase, started):
+    seconds = time.perf_counter() - started
+    totals = getattr(_phase_totals, 'totals', None)
+    if totals is not None:
+        totals[phase] = totals.get(phase, 0.0) + seconds
+    elif phase_observer is not None:
+        phase_observer(phase, seconds)
+
+
+@contextmanager
+def _combined_phases():
+    """Reports each phase once for everything timed inside the block, summing engines that ran in turn."""
+    if getattr(_phase_totals, 'totals', None) is not None:
+        yield
+        return
+    _phase_totals.totals = {}
+    try:
+        yield
+    finally:
+        totals, _phase_totals.totals = _phase_totals.totals, None
+        if phase_observer is not None:
+            for phase, seconds in totals.items():
+                phase_observer(phase, seconds)
+
+
+def parse_with_soup(html):
+    """
+    Extracts the key card fields from a TAG Grading card page using user-provided logic.
+    """
+    started = time.perf_counter()
+    soup = BeautifulSoup(html, 'html.parser')
+    _observe('parse', started)
+    started = time.perf_counter()
+    data = {}
+    
+    # --- Scrape using parent and replace for robust text handling ---
+    try:
+        player_label = soup.find("span", string="Player name:")
+        if player_label:
+            data['player_name'] = player_label.find_next_sibling('span').get_text(strip=True)
+        else:
+            data['player_name'] = 'N/A'
+            logging.warning("Player name not found.")
+    except AttributeError:
+        data['player_name'] = 'N/A'
+        logging.warning("Player name data not found.")
+
+    try:
+        set_name_label = soup.find("span", string="Set name:")
+        if set_name_label:
+            set_name_full_text = set_name_label.parent.get_text(strip=True)
+            data['set_name'] = set_name_full_text.replace("Set name:", "").strip()
+        else:
+            data['set_name'] = 'N/A'
+            logging.warning("Set name not found.")
+    except AttributeError:
+        data['set_name'] = 'N/A'
+        logging.warning("Set name data not found.")
+        
+    try:
+        subset_label = soup.find("span", string="Subset:")
+        if subset_label:
+            subset_full_text = subset_label.parent.get_text(strip=True)
+            subset_val = subset_full_text.replace("Subset:", "").strip()
+            data['subset'] = subset_val if subset_val and subset_val != '-' else 'N/A'
+        else:
+            data['subset'] = 'N/A'
+            logging.warning("Subset not found.")
+    except AttributeError:
+        data['subset'] = 'N/A'
+        logging.warning("Subset data not found.")
+
+    try:
+        variation_label = soup.find("span", string="Variation:")
+        if variation_label:
+            variation_full_text = variation_label.parent.get_text(strip=True)
+            variation_val = variation_full_text.replace("Variation:", "").strip()
+            data['variation'] = variation_val if variation_val and variation_val != '-' else 'N/A'
+        else:
+            data['variation'] = 'N/A'
+            logging.warning("Variation not found.")
+    except AttributeError:
+        data['variation'] = 'N/A'
+        logging.warning("Variation data not found.")
+
+    # --- Find TAG Score, Grade, and Grade Name ---
+    # Re-using a previous, reliable method
+    try:
+        tag_score_div = soup.find('div', string=TAG_SCORE_PATTERN)
+        if tag_score_div:
+            parent_div = tag_score_div.find_parent('div')
+            score_div = parent_div.find_previous_sibling('div').find('div')
+            data['tag_score'] = score_div.get_text(strip=True)
+
+            grade_container = parent_div.find_next_sibling('div')
+            data['grade'] = grade_container.find('div').get_text(strip=True)
+            data['grade_name'] = grade_container.find_all('div')[-1].get_text(strip=True)
+    except (AttributeError, IndexError):
+        logging.warning("TAG Score or Grade data not found.")
+        data['tag_score'] = 'N/A'
+        data['grade'] = 'N/A'
+        data['grade_name'] = 'N/A'
+
+    _observe('extraction', started)
+    logging.info(f"Finished scraping. Data collected: {data}")
+    return data
+
+
+def _lxml_string(el):
+    """Equivalent of BeautifulSoup's Tag.string: the text of an element whose only content is one string."""
+    while True:
+        children = list(el)
+        if not children:
+            return el.text
+        if len(children) > 1 or el.text or children[0].tail:
+            return None
+        el = children[0]
+        if not isinstance(el.tag, str):  # a lone comment is a string to BeautifulSoup
+            return el.text
+
+
+def _lxml_text(el):
+    """Equivalent of BeautifulSoup's get_text(strip=True)."""
+    return ''.join(s.strip() for s in el.itertext() if s.strip())
+
+
+def _lxml_label_value(labels, label_text, name):
+    """Text of a label's parent with the label removed, as the soup engine computes it."""
+    label = labels.get(SPAN_LABELS[label_text])
+    if label is None:
+        logging.warning(f"{name} not found.")
+        return 'N/A'
+    return _lxml_text(label.getparent()).replace(label_text, "").strip()
+
+
+def _lxml_match(el):
+    """Returns the data key a span label or the TAG Score div stands for, or None."""
+    text = _lxml_string(el)
+    if text is None:
+        return None
+    if el.tag == 'span':
+        return SPAN_LABELS.get(text)
+    if el.tag == 'div' and TAG_SCORE_PATTERN.search(text):
+        return 'tag_score'
+    return None
+
+
+def _lxml_extract(labels):
+    """Builds the card data dict from the label elements located by an lxml engine."""
+    data = {}
+    player_label = labels.get('player_name')
+    value = next(player_label.itersiblings('span'), None) if player_label is not None else None
+    if player_label is None:
+        logging.warning("Player name not found.")
+        data['player_name'] = 'N/A'
+    elif value is None:
+        logging.warning("Player name data not found.")
+        data['player_name'] = 'N/A'
+    else:
+        data['player_name'] = _lxml_text(value)
+
+    data['set_name'] = _lxml_label_value(labels, "Set name:", "Set name")
+    for key, label_text, name in (('subset', "Subset:", "Subset"), ('variation', "Variation:", "Variation")):
+        value = _lxml_label_value(labels, label_text, name)
+        data[key] = value if value and value != '-' else 'N/A'
+
+    tag_score_div = labels.get('tag_score')
+    if tag_score_div is not None:
+        try:
+            parent_div = next(tag_score_div.iterancestors('div'))
+            score_div = next(next(parent_div.itersiblings('div', preceding=True)).iterdescendants('div'))
+            data['tag_score'] = _lxml_text(score_div)
+
+            grade_container = next(parent_div.itersiblings('div'))
+            grade_divs = list(grade_container.iterdescendants('div'))
+            data['grade'] = _lxml_text(grade_divs[0])
+            data['grade_name'] = _lxml_text(grade_divs[-1])
+        except (StopIteration, IndexError):
+            logging.warning("TAG Score or Grade data not found.")
+            data['tag_score'] = 'N/A'
+            data['grade'] = 'N/A'
+            data['grade_name'] = 'N/A'
+
+    logging.info(f"Finished scraping. Data collected: {data}")
+    return data
+
+
+def parse_with_lxml(html):
+    """
+    Extracts the key card fields using lxml, locating every label in a single walk
+    of the tree instead of one full search per field.
+    """
+    started = time.perf_counter()
+    try:
+        try:
+            root = lxml.html.document_fromstring(html)
+        except ValueError:
+            # lxml refuses str input that carries an XML encoding declaration
+            root = lxml.html.document_fromstring(html.encode('utf-8'))
+    except lxml.etree.ParserError as e:
+        # Blank and comment-only pages have no root element; the soup engine reads them as having no fields
+        logging.warning(f"lxml could not build a document: {e}")
+        root = None
+    _observe('parse', started)
+
+    started = time.perf_counter()
+    labels = {}
+    for el in (root.iter('span', 'div') if root is not None else ()):
+        key = _lxml_match(el)
+        if key is not None and key not in labels:
+            labels[key] = el
+            if len(labels) == ALL_LABELS:
+                break
+    data = _lxml_extract(labels)
+    _observe('extraction', started)
+    return data
+
+
+def _lxml_label_complete(key, label, el):
+    """True once the end of el means everything the extractor reads around label has been parsed."""
+    if key != 'tag_score':
+        # Span values are read from the label's parent, which ends after its siblings
+        return el is label.getparent()
+    parent_div = next(label.iterancestors('div'), None)
+    if parent_div is None or el is parent_div.getparent():
+        return True
+    # The grade container is the first div after parent_div, so it closing means the score block is done
+    return el.tag == 'div' and next(el.itersiblings('div', preceding=True), None) is parent_div
+
+
+def parse_partial(html, chunk_size=PARTIAL_CHUNK_SIZE):
+    """
+    Extracts the key card fields by feeding the page to an incremental lxml parser
+    chunk by chunk, and stops building the tree as soon as every field has been
+    parsed. Falls back to parsing the whole page when some label is missing.
+    """
+    started = time.perf_counter()
+    parser = lxml.etree.HTMLPullParser(events=('end',))
+    labels, complete = {}, {}
+
+    def consume_events():
+        for _, el in parser.read_events():
+            key = _lxml_match(el) if el.tag in ('span', 'div') else None
+            if key is not None:
+                current = labels.get(key)
+                # Elements end innermost first, so an enclosing match replaces a nested one
+                # to keep the document-order first match the other engines pick
+                if current is None or any(ancestor is el for ancestor in current.iterancestors()):
+                    labels[key] = el
+                    complete[key] = False
+            for key, label in labels.items():
+                if not complete[key] and _lxml_label_complete(key, label, el):
+                    complete[key] = True
+        return len(complete) == ALL_LABELS and all(complete.values())
+
+    try:
+        for start in range(0, len(html), chunk_size):
+            parser.feed(html[start:start + chunk_size])
+            if consume_events():
+                break
+        else:
+            parser.close()
+            consume_events()
+    except lxml.etree.LxmlError as e:
+        # An empty page has no root element to close; like the soup engine, keep whatever labels were found
+        logging.warning(f"Partial parser stopped early: {e}")
+    # Label matching happens while the tree is built, so it counts towards parsing
+    _observe('parse', started)
+
+    started = time.perf_counter()
+    data = _lxml_extract(labels)
+    _observe('extraction', started)
+    return data
+
+
+def _embedded_documents(html):
+    """Yields every JSON document embedded in the page's script tags."""
+    decoder = json.JSONDecoder()
+    for attrs, body in SCRIPT_PATTERN.findall(html):
+        body = body.strip()
+        if not body:
+            continue
+        if JSON_SCRIPT_ATTRS.search(attrs):
+            try:
+                yield json.loads(body)
+            except ValueError:
+                pass
+            continue
+        for match in STATE_ASSIGNMENT.finditer(body):
+            try:
+                yield decoder.raw_decode(body, match.end())[0]
+            except ValueError:
+                pass
+
+
+def _embedded_value(value):
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def _embedded_card(document):
+    """Finds the object in a JSON document that carries the most card fields, as {data key: value}."""
+    best = {}
+    stack = [document]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(node)
+            continue
+        if not isinstance(node, dict):
+            continue
+        found = {}
+        for name, value in node.items():
+            if isinstance(value, (dict, list)):
+                stack.append(value)
+            elif value is not None and not isinstance(value, bool):
+                key = EMBEDDED_KEYS.get(name)
+                if key is not None and key not in found:
+                    found[key] = _embedded_value(value)
+        if len(found) > len(best):
+            best = found
+    return best
+
+
+def extract_embedded(html):
+    """
+    Reads the card fields from JSON state embedded in the page (a __NEXT_DATA__
+    script, a JSON script tag or a window.__STATE__ assignment) without building
+    an HTML tree. Returns None when no embedded card data is found.
+    """
+    started = time.perf_counter()
+    documents = list(_embedded_documents(html))
+    _observe('parse', started)
+
+    started = time.perf_counter()
+    best = {}
+    for document in documents:
+        found = _embedded_card(document)
+        if len(found) > len(best):
+            best = found
+    # One matching field could be any JSON object; two or more of ours is a card
+    if len(best) < 2 or not {'player_name', 'grade'} & best.keys():
+        _observe('extraction', started)
+        return None
+
+    data = {'player_name': best.get('player_name') or 'N/A', 'set_name': best.get('set_name') or 'N/A'}
+    for key in ('subset', 'variation'):
+        value = best.get(key)
+        data[key] = value if value and value != '-' else 'N/A'
+    # Like the DOM extractors, the score keys only appear when the page has a score block
+    if {'tag_score', 'grade', 'grade_name'} & best.keys():
+        for key in ('tag_score', 'grade', 'grade_name'):
+            data[key] = best.get(key) or 'N/A'
+    _observe('extraction', started)
+    return data
+
+
+def parse_embedded(html, fallback=None):
+    """
+    Extracts the key card fields from embedded JSON state, falling back to a DOM
+    engine (the default one unless given) when the page carries none.
+    """
+    # One page is one parse and one extraction, however many engines it took
+    with _combined_phases():
+        data = extract_embedded(html)
+        if data is not None:
+            logging.info(f"Finished scraping from embedded JSON. Data collected: {data}")
+            return data
+        logging.info("No embedded card data found, falling back to the DOM extractor.")
+        return (fallback or PARSERS[DEFAULT_DOM_PARSER])(html)
+
+
+PARSERS = {
+    'soup': parse_with_soup,
+    'lxml': parse_with_lxml,
+    'partial': parse_partial,
+    'embedded': parse_embedded,
+}
+
+DEFAULT_DOM_PARSER = 'partial' if lxml is not None else 'soup'
+DEFAULT_PARSER = 'embedded'
+
+
+def get_parser(name=None):
+    """Returns the extraction function for an engine name, falling back to the default engine."""
+    name = name or DEFAULT_PARSER
+    if name not in PARSERS:
+        raise ValueError(f"Unknown card parser {name!r}; choose one of {sorted(PARSERS)}")
+    if name in ('lxml', 'partial') and lxml is None:
+        logging.warning("lxml is not installed, falling back to the soup parser.")
+        name = 'soup'
+    return PARSERS[name]
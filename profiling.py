@@ -0,0 +1,217 @@
+"""
+Profiling helpers: one-off request profiles written as pstats plus collapsed
+stacks (the input format of flamegraph.pl and speedscope), and an always-on
+sampler that keeps a rolling window of collapsed stacks.
+"""
+import os
+import re
+import sys
+import time
+import uuid
+import cProfile
+import logging
+import threading
+from collections import Counter, deque
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def collapse_stack(frame):
+    """One stack as 'outermost;...;innermost' frame labels."""
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+# Innermost frames of threads that are parked waiting for work or blocked on the
+# network (connecting, TLS handshakes, reading upstream responses), by (file, function)
+IDLE_FRAMES = {
+    ('threading.py', 'wait'),
+    ('queue.py', 'get'),
+    ('selectors.py', 'select'),
+    ('socket.py', 'accept'),
+    ('socketserver.py', 'serve_forever'),
+    ('thread.py', '_worker'),
+    ('sync.py', 'sleep'),
+    ('arbiter.py', 'sleep'),
+    ('socket.py', 'create_connection'),
+    ('socket.py', 'readinto'),
+    ('ssl.py', 'do_handshake'),
+    ('ssl.py', 'read'),
+}
+
+
+def is_idle(frame):
+    code = frame.f_code
+    return (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES
+
+
+def format_collapsed(counts):
+    return ''.join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+
+def write_collapsed(path, counts):
+    """Writes {collapsed stack: sample count} in the folded format, hottest stacks first."""
+    with open(path, 'w') as f:
+        f.write(format_collapsed(counts))
+
+
+class StackSampler:
+    """
+    Background thread that records the stack of one thread every interval
+    seconds, counting identical stacks together.
+    """
+
+    def __init__(self, thread_id, interval=0.001):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.counts
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.counts[collapse_stack(frame)] += 1
+            del frame
+
+
+class RequestProfile:
+    """
+    Profiles the calling thread from start() to stop() with cProfile and a stack
+    sampler, then writes <name>.pstats and <name>.collapsed into directory.
+    """
+
+    def __init__(self, directory, label, sample_interval=0.001):
+        self.directory = directory
+        slug = re.sub(r'[^A-Za-z0-9]+', '-', label).strip('-')[:80]
+        self.name = f"{time.strftime('%Y%m%d-%H%M%S')}-{slug}-{uuid.uuid4().hex[:8]}"
+        self._profiler = cProfile.Profile()
+        self._sampler = StackSampler(threading.get_ident(), sample_interval)
+        self._active = False
+
+    def start(self):
+        """Starts profiling; returns False when another profiler already owns the interpreter."""
+        try:
+            self._profiler.enable()
+        except ValueError as e:
+            logging.warning(f"Could not start request profile {self.name}: {e}")
+            return False
+        self._sampler.start()
+        self._active = True
+        return True
+
+    def stop(self):
+        """Stops profiling, writes both files and returns the profile name."""
+        if not self._active:
+            return None
+        self._profiler.disable()
+        counts = self._sampler.stop()
+        self._active = False
+
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, self.name)
+        self._profiler.dump_stats(f"{base}.pstats")
+        write_collapsed(f"{base}.collapsed", counts)
+        logging.info(f"Wrote request profile {base}.pstats ({sum(counts.values())} stack samples)")
+        return self.name
+
+
+class RollingStackSampler:
+    """
+    Always-on statistical profiler. A daemon thread wakes every interval seconds,
+    records the collapsed stack of every other thread, and files the counts into
+    bucket_seconds-wide buckets, keeping window seconds.
+
+    Threads parked in a known waiting frame (idle workers, accept loops,
+    blocking socket and SSL reads) are skipped, so the samples approximate
+    where CPU time goes; time spent waiting on the upstream is in the
+    tag_scrape_phase_seconds metric instead.
+    """
+
+    def __init__(self, interval=0.01, window=300, bucket_seconds=10):
+        self.interval = interval
+        self.window = window
+        self.bucket_seconds = bucket_seconds
+        self._lock = threading.Lock()
+        self._buckets = deque()  # (bucket start, Counter)
+        self._thread = None
+        self._pid = None
+        self.samples = 0
+        self.sampling_seconds = 0.0
+        self.started_at = None
+
+    def ensure_running(self):
+        """Starts the sampler thread, again in a forked worker whose parent started it."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._buckets.clear()
+            self.started_at = time.time()
+            self._thread = threading.Thread(target=self._run, name='rolling-sampler', daemon=True)
+            self._thread.start()
+
+    def snapshot(self, seconds=None):
+        """Merged {collapsed stack: samples} over the last seconds (default: the whole window)."""
+        cutoff = time.time() - (seconds if seconds is not None else self.window)
+        merged = Counter()
+        with self._lock:
+            for start, counts in self._buckets:
+                if start + self.bucket_seconds > cutoff:
+                    merged.update(counts)
+        return merged
+
+    def stats(self):
+        with self._lock:
+            uptime = time.time() - self.started_at if self.started_at else 0.0
+            return {
+                "interval": self.interval,
+                "window": self.window,
+                "samples": self.samples,
+                "buckets": len(self._buckets),
+                # Share of one core spent in the sampler itself
+                "overhead": (self.sampling_seconds / uptime) if uptime else 0.0,
+            }
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            started = time.perf_counter()
+            frames = sys._current_frames()
+            stacks = [collapse_stack(frame) for thread_id, frame in frames.items()
+                      if thread_id != own_id and not is_idle(frame)]
+            # Holding on to frames would keep every local variable they reference alive
+            del frames
+            self._record(stacks)
+            with self._lock:
+                self.sampling_seconds += time.perf_counter() - started
+
+    def _record(self, stacks):
+        now = time.time()
+        bucket_start = now - now % self.bucket_seconds
+        with self._lock:
+            if not self._buckets or self._buckets[-1][0] != bucket_start:
+                self._buckets.append((bucket_start, Counter()))
+                while self._buckets and self._buckets[0][0] + self.bucket_seconds <= now - self.window:
+                    self._buckets.popleft()
+            self._buckets[-1][1].update(stacks)
+            self.samples += len(stacks)
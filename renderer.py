@@ -0,0 +1,200 @@
+"""
+Pool of long-lived headless browsers for card pages that only fill in after JavaScript runs.
+
+Selenium is optional: without it the pool can still be built with a custom
+driver_factory, but the default Chrome factory raises RuntimeError.
+"""
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+try:
+    from selenium import webdriver
+    from selenium.common.exceptions import TimeoutException, WebDriverException
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+except ImportError:  # selenium is only needed when the rendered path is enabled
+    webdriver = By = WebDriverWait = None
+
+    class WebDriverException(Exception):
+        pass
+
+    class TimeoutException(WebDriverException):
+        pass
+
+# Elements that only exist once the card page has rendered its labels and grade
+CARD_READY_XPATHS = (
+    "//span[normalize-space()='Player name:']",
+    "//div[contains(normalize-space(), 'TAG Score')]",
+)
+
+
+def create_chrome_driver():
+    """Starts one headless Chrome tuned for scraping: no images, no GPU, eager page loads."""
+    if webdriver is None:
+        raise RuntimeError("selenium is not installed; the rendered scrape path is unavailable.")
+    options = webdriver.ChromeOptions()
+    options.add_argument("--headless=new")
+    options.add_argument("--log-level=3")
+    options.add_argument("--disable-gpu")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    options.add_argument("--blink-settings=imagesEnabled=false")
+    options.page_load_strategy = 'eager'
+    return webdriver.Chrome(options=options)
+
+
+class BrowserPool:
+    """
+    Fixed-size pool of warm browser instances leased out one request at a time.
+
+    Browsers are started lazily up to size, health-checked before every lease,
+    and replaced after max_uses page loads or whenever a lease raises a driver error.
+    """
+
+    def __init__(self, size=2, max_uses=200, wait_timeout=10, lease_timeout=30, driver_factory=None):
+        self.size = size
+        self.max_uses = max_uses
+        self.wait_timeout = wait_timeout
+        self.lease_timeout = lease_timeout
+        self.driver_factory = driver_factory or create_chrome_driver
+        self._idle = []  # [driver, uses] pairs; used as a stack so the warmest browser goes out first
+        self._cond = threading.Condition()
+        self._started = 0
+        self._closed = False
+        self.leases = 0
+        self.recycled = 0
+        self.timeouts = 0
+
+    def warm(self):
+        """Starts every browser up front so the first requests don't pay the launch cost."""
+        with self._cond:
+            missing = self.size - self._started
+            self._started += missing
+        for _ in range(missing):
+            try:
+                entry = [self.driver_factory(), 0]
+            except Exception as e:
+                logging.error(f"Could not start browser for the pool: {e}")
+                self._forget()
+                continue
+            self._release(entry)
+
+    @contextmanager
+    def lease(self):
+        """Yields a healthy driver for the duration of one request."""
+        entry = self._acquire()
+        try:
+            yield entry[0]
+        except WebDriverException:
+            self._discard(entry)
+            raise
+        except BaseException:
+            self._release(entry)
+            raise
+        else:
+            entry[1] += 1
+            self._release(entry)
+
+    def render(self, url, ready_xpaths=CARD_READY_XPATHS):
+        """
+        Loads url in a pooled browser and returns the page source once every ready
+        XPath matches, or whatever has rendered when wait_timeout runs out.
+        """
+        with self.lease() as driver:
+            driver.get(url)
+            try:
+                WebDriverWait(driver, self.wait_timeout).until(
+                    lambda d: all(d.find_elements(By.XPATH, xpath) for xpath in ready_xpaths)
+                )
+            except TimeoutException:
+                with self._cond:
+                    self.timeouts += 1
+                logging.warning(f"Timed out waiting for {url} to render, using partial page.")
+            return driver.page_source
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._started -= len(idle)
+            self._cond.notify_all()
+        for entry in idle:
+            self._quit(entry)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "size": self.size,
+                "started": self._started,
+                "idle": len(self._idle),
+                "leases": self.leases,
+                "recycled": self.recycled,
+                "timeouts": self.timeouts,
+            }
+
+    def _acquire(self):
+        deadline = time.monotonic() + self.lease_timeout
+        while True:
+            entry = None
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise RuntimeError("Browser pool is closed.")
+                    if self._idle:
+                        entry = self._idle.pop()
+                        break
+                    if self._started < self.size:
+                        self._started += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(f"No browser became free within {self.lease_timeout}s.")
+                    self._cond.wait(remaining)
+
+            if entry is None:
+                try:
+                    entry = [self.driver_factory(), 0]
+                except Exception:
+                    self._forget()
+                    raise
+            if self._healthy(entry[0]):
+                with self._cond:
+                    self.leases += 1
+                return entry
+            logging.warning("Pooled browser failed its health check, replacing it.")
+            self._discard(entry)
+
+    def _healthy(self, driver):
+        try:
+            driver.execute_script("return 1")
+            return True
+        except Exception:
+            return False
+
+    def _release(self, entry):
+        with self._cond:
+            if entry[1] < self.max_uses and not self._closed:
+                self._idle.append(entry)
+                self._cond.notify()
+                return
+        self._discard(entry)
+
+    def _discard(self, entry):
+        self._quit(entry)
+        with self._cond:
+            self.recycled += 1
+        self._forget()
+
+    def _forget(self):
+        """Frees the slot of a browser that is gone so a waiting lease can start a new one."""
+        with self._cond:
+            self._started -= 1
+            self._cond.notify()
+
+    def _quit(self, entry):
+        try:
+            entry[0].quit()
+        except Exception:
+            pass
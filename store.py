@@ -0,0 +1,811 @@
+"""
+Storage for user accounts and their card collections.
+
+SqliteUserStore keeps everything in SQLite. JournaledUserStore keeps the
+users.json format on disk, serving from memory and appending each change
+to a journal that is folded back into users.json in the background.
+ResidentUserStore serves from memory too and rewrites users.json shortly
+after changes, batching them.
+"""
+import os
+import atexit
+import json
+import time
+import signal
+import sqlite3
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows has no fcntl; SQLite's busy handler alone then serializes writers
+    fcntl = None
+
+from card_cache import normalize_cert
+
+
+class VersionConflict(Exception):
+    """Raised when a collection changed after the version a caller based its edit on."""
+
+    def __init__(self, username, expected, actual):
+        super().__init__(f"Collection of {username} is at version {actual}, not {expected}")
+        self.username = username
+        self.expected = expected
+        self.actual = actual
+
+
+class SqliteUserStore:
+    """
+    Users, cards, collection ownership and hashtags in a SQLite database in WAL mode.
+
+    Card fields are stored once per cert and shared by every collection holding
+    it; a collection row keeps the card's position so the default order is the
+    order cards were added. Every read and write is an indexed lookup on one user,
+    so its cost doesn't grow with the number of users or cards on the site.
+    Collections come back in the users.json shape the templates use: card dicts
+    with a 'hashtags' list.
+
+    Any number of threads and worker processes may share the database: every
+    write is one short BEGIN IMMEDIATE transaction, and reads see a consistent
+    snapshot. Writers queue on an flock of <path>.lock before starting their
+    transaction, which hands the database to the next writer as soon as it is
+    free instead of leaving them in SQLite's sleep-and-retry busy loop.
+
+    Each collection carries a version that goes up with every change to it;
+    passing the version read earlier as expected_version makes a write fail
+    with VersionConflict instead of overwriting a concurrent edit.
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS users ("
+        " id INTEGER PRIMARY KEY,"
+        " username TEXT NOT NULL UNIQUE,"
+        " password TEXT NOT NULL,"
+        " is_admin INTEGER NOT NULL DEFAULT 0,"
+        " collection_version INTEGER NOT NULL DEFAULT 0)",
+        "CREATE TABLE IF NOT EXISTS cards ("
+        " cert_number TEXT PRIMARY KEY,"
+        " data TEXT NOT NULL,"
+        " updated_at REAL NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS collection_cards ("
+        " user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,"
+        " cert_number TEXT NOT NULL REFERENCES cards(cert_number),"
+        " position INTEGER NOT NULL,"
+        " added_at REAL NOT NULL,"
+        " PRIMARY KEY (user_id, cert_number))",
+        "CREATE INDEX IF NOT EXISTS collection_cards_position ON collection_cards (user_id, position)",
+        "CREATE INDEX IF NOT EXISTS collection_cards_cert ON collection_cards (cert_number)",
+        "CREATE TABLE IF NOT EXISTS card_hashtags ("
+        " user_id INTEGER NOT NULL,"
+        " cert_number TEXT NOT NULL,"
+        " tag TEXT NOT NULL,"
+        " PRIMARY KEY (user_id, cert_number, tag),"
+        " FOREIGN KEY (user_id, cert_number) REFERENCES collection_cards (user_id, cert_number)"
+        " ON DELETE CASCADE)",
+        "CREATE INDEX IF NOT EXISTS card_hashtags_tag ON card_hashtags (user_id, tag)",
+    )
+
+    def __init__(self, path, busy_timeout=5.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        with self._transaction() as conn:
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(users)")}
+            if 'collection_version' not in columns:  # databases created before collections were versioned
+                conn.execute("ALTER TABLE users ADD COLUMN collection_version INTEGER NOT NULL DEFAULT 0")
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        # A connection inherited across fork() must not be reused by the child
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+            # One open file per thread, since flock doesn't exclude holders of the same open file
+            self._local.lock_file = open(f"{self.path}.lock", 'a') if fcntl is not None else None
+        return conn
+
+    @contextmanager
+    def _transaction(self, write=True):
+        """
+        Runs a block of statements atomically. Writes take the database write lock
+        up front, so two processes never both read a collection and then write it.
+        """
+        conn = self._connect()
+        lock_file = self._local.lock_file if write else None
+        if lock_file is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            if lock_file is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _editable_user_id(self, conn, username, expected_version):
+        """Id of the user whose collection is about to change, checking expected_version when given."""
+        row = conn.execute(
+            "SELECT id, collection_version FROM users WHERE username = ?", (username,)
+        ).fetchone()
+        if row is None:
+            return None
+        if expected_version is not None and row[1] != expected_version:
+            raise VersionConflict(username, expected_version, row[1])
+        return row[0]
+
+    def _bump_version(self, conn, user_id):
+        conn.execute("UPDATE users SET collection_version = collection_version + 1 WHERE id = ?", (user_id,))
+
+    # --- Users ---
+
+    def usernames(self):
+        return [row[0] for row in self._connect().execute("SELECT username FROM users ORDER BY id")]
+
+    def get_user(self, username):
+        """The account fields of a user (without the collection), or None."""
+        row = self._connect().execute(
+            "SELECT password, is_admin FROM users WHERE username = ?", (username,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"password": row[0], "is_admin": bool(row[1])}
+
+    def create_user(self, username, password_hash, is_admin=False):
+        """Adds a user with an empty collection; False when the username is taken."""
+        try:
+            with self._transaction() as conn:
+                conn.execute(
+                    "INSERT INTO users (username, password, is_admin) VALUES (?, ?, ?)",
+                    (username, password_hash, int(is_admin)),
+                )
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def set_password(self, username, password_hash):
+        with self._transaction() as conn:
+            return conn.execute(
+                "UPDATE users SET password = ? WHERE username = ?", (password_hash, username)
+            ).rowcount > 0
+
+    def delete_user(self, username):
+        with self._transaction() as conn:
+            return conn.execute("DELETE FROM users WHERE username = ?", (username,)).rowcount > 0
+
+    # --- Collections ---
+
+    def get_collection(self, username):
+        """A user's cards in the order they were added, or None for an unknown user."""
+        collection, _ = self.get_versioned_collection(username)
+        return collection
+
+    def get_versioned_collection(self, username):
+        """(cards, version) of a user's collection from one snapshot, or (None, None) for an unknown user."""
+        with self._transaction(write=False) as conn:
+            row = conn.execute(
+                "SELECT id, collection_version FROM users WHERE username = ?", (username,)
+            ).fetchone()
+            if row is None:
+                return None, None
+            user_id, version = row
+            tags = {}
+            for cert_number, tag in conn.execute(
+                "SELECT cert_number, tag FROM card_hashtags WHERE user_id = ? ORDER BY rowid", (user_id,)
+            ):
+                tags.setdefault(cert_number, []).append(tag)
+
+            collection = []
+            for cert_number, data in conn.execute(
+                "SELECT c.cert_number, c.data FROM collection_cards cc"
+                " JOIN cards c ON c.cert_number = cc.cert_number"
+                " WHERE cc.user_id = ? ORDER BY cc.position",
+                (user_id,),
+            ):
+                card = json.loads(data)
+                if cert_number in tags:
+                    card['hashtags'] = tags[cert_number]
+                collection.append(card)
+        return collection, version
+
+    def collection_version(self, username):
+        row = self._connect().execute(
+            "SELECT collection_version FROM users WHERE username = ?", (username,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def has_card(self, username, cert_number):
+        return self._connect().execute(
+            "SELECT 1 FROM collection_cards cc JOIN users u ON u.id = cc.user_id"
+            " WHERE u.username = ? AND cc.cert_number = ?",
+            (username, normalize_cert(cert_number)),
+        ).fetchone() is not None
+
+    def add_card(self, username, card, expected_version=None):
+        """
+        Appends a card dict to a user's collection and stores its fields, keeping
+        any previously stored value the new scrape left empty. Returns False when
+        the cert is already in the collection; raises KeyError for an unknown user.
+        """
+        cert_number = normalize_cert(card['cert_number'])
+        data = {key: value for key, value in card.items() if key != 'hashtags'}
+        with self._transaction() as conn:
+            user_id = self._editable_user_id(conn, username, expected_version)
+            if user_id is None:
+                raise KeyError(username)
+            if conn.execute(
+                "SELECT 1 FROM collection_cards WHERE user_id = ? AND cert_number = ?", (user_id, cert_number)
+            ).fetchone():
+                return False
+            row = conn.execute("SELECT data FROM cards WHERE cert_number = ?", (cert_number,)).fetchone()
+            if row is not None:
+                # A failed scrape must not blank fields other collections already show for this cert
+                stored = json.loads(row[0])
+                data.update({key: value for key, value in stored.items() if value and not data.get(key)})
+            now = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO cards (cert_number, data, updated_at) VALUES (?, ?, ?)",
+                (cert_number, json.dumps(data), now),
+            )
+            conn.execute(
+                "INSERT INTO collection_cards (user_id, cert_number, position, added_at)"
+                " SELECT ?, ?, COALESCE(MAX(position), 0) + 1, ? FROM collection_cards WHERE user_id = ?",
+                (user_id, cert_number, now, user_id),
+            )
+            for tag in card.get('hashtags', []):
+                conn.execute(
+                    "INSERT OR IGNORE INTO card_hashtags (user_id, cert_number, tag) VALUES (?, ?, ?)",
+                    (user_id, cert_number, tag),
+                )
+            self._bump_version(conn, user_id)
+        return True
+
+    def remove_card(self, username, cert_number, expected_version=None):
+        return self._edit_collection(
+            username, expected_version,
+            "DELETE FROM collection_cards WHERE user_id = :user_id AND cert_number = :cert_number",
+            {"cert_number": normalize_cert(cert_number)},
+        )
+
+    def add_hashtag(self, username, cert_number, tag, expected_version=None):
+        """Tags a card in a user's collection; False when the card isn't there or already has the tag."""
+        return self._edit_collection(
+            username, expected_version,
+            "INSERT OR IGNORE INTO card_hashtags (user_id, cert_number, tag)"
+            " SELECT user_id, cert_number, :tag FROM collection_cards"
+            " WHERE user_id = :user_id AND cert_number = :cert_number",
+            {"cert_number": normalize_cert(cert_number), "tag": tag},
+        )
+
+    def remove_hashtag(self, username, cert_number, tag, expected_version=None):
+        return self._edit_collection(
+            username, expected_version,
+            "DELETE FROM card_hashtags WHERE user_id = :user_id AND cert_number = :cert_number AND tag = :tag",
+            {"cert_number": normalize_cert(cert_number), "tag": tag},
+        )
+
+    def _edit_collection(self, username, expected_version, sql, params):
+        """Runs one statement on a user's collection; True (and a new version) when it changed a row."""
+        with self._transaction() as conn:
+            user_id = self._editable_user_id(conn, username, expected_version)
+            if user_id is None:
+                return False
+            if conn.execute(sql, dict(params, user_id=user_id)).rowcount == 0:
+                return False
+            self._bump_version(conn, user_id)
+            return True
+
+    # --- Migration ---
+
+    def import_users(self, users):
+        """Loads a users.json-shaped dict, skipping users that already exist. Returns how many were added."""
+        added = 0
+        for username, user in users.items():
+            if not self.create_user(username, user['password'], user.get('is_admin', False)):
+                continue
+            for card in user.get('collection', []):
+                self.add_card(username, card)
+            added += 1
+        return added
+
+    def import_users_json(self, path):
+        """One-time migration from the login-era users.json, done only while the database has no users."""
+        if self._connect().execute("SELECT 1 FROM users LIMIT 1").fetchone():
+            return 0
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return 0
+        with open(path) as f:
+            added = self.import_users(json.load(f))
+        logging.info(f"Imported {added} users from {path} into {self.path}")
+        return added
+
+    def stats(self):
+        conn = self._connect()
+        return {
+            "users": conn.execute("SELECT COUNT(*) FROM users").fetchone()[0],
+            "cards": conn.execute("SELECT COUNT(*) FROM cards").fetchone()[0],
+            "collection_cards": conn.execute("SELECT COUNT(*) FROM collection_cards").fetchone()[0],
+            "path": self.path,
+        }
+
+
+def load_users_json(path):
+    """Reads a users.json snapshot; a missing or empty file is an empty site."""
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+
+def write_durable(path, data):
+    """
+    Replaces path with data so that after a crash it holds either the old or the
+    new contents: write a temporary file, fsync it, rename it over path, fsync the directory.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def _copy_card(card):
+    card = dict(card)
+    if 'hashtags' in card:
+        card['hashtags'] = list(card['hashtags'])
+    return card
+
+
+class CardCollection:
+    """
+    One user's cards as an insertion-ordered mapping from cert number to card dict.
+
+    Lookups, duplicate checks and removals by cert are O(1), while iterating
+    yields the card dicts in the order they were added, like the users.json
+    list, so templates can loop over it unchanged.
+    """
+
+    def __init__(self, cards=()):
+        self._cards = {}
+        for card in cards:
+            self._cards.setdefault(normalize_cert(card['cert_number']), card)
+
+    def __iter__(self):
+        return iter(self._cards.values())
+
+    def __len__(self):
+        return len(self._cards)
+
+    def __contains__(self, cert_number):
+        return normalize_cert(cert_number) in self._cards
+
+    def get(self, cert_number):
+        return self._cards.get(normalize_cert(cert_number))
+
+    def add(self, card):
+        """Appends a card; False when its cert is already in the collection."""
+        cert_number = normalize_cert(card['cert_number'])
+        if cert_number in self._cards:
+            return False
+        self._cards[cert_number] = card
+        return True
+
+    def remove(self, cert_number):
+        return self._cards.pop(normalize_cert(cert_number), None) is not None
+
+    def to_list(self):
+        return list(self._cards.values())
+
+
+def _encode_collection(value):
+    if isinstance(value, CardCollection):
+        return value.to_list()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+class _ResidentUsers:
+    """
+    users.json-shaped data held in memory and changed only by applying mutation
+    entries, e.g. {"op": "add_card", "username": ..., "card": {...}}.
+
+    Applying an entry is idempotent: an entry whose effect is already in the
+    data changes nothing, so replaying it after a crash is harmless. Subclasses
+    decide how a change that did happen is made durable, in _record().
+    Collections are held as CardCollections and written back out as lists.
+    """
+
+    def __init__(self, users=None):
+        self._users = users or {}
+        for user in self._users.values():
+            user['collection'] = CardCollection(user.get('collection', []))
+        self._lock = threading.RLock()
+
+    def _record(self, entry):
+        raise NotImplementedError
+
+    def _mutate(self, entry):
+        with self._lock:
+            changed = self._apply(entry)
+            if changed:
+                self._record(entry)
+        return changed
+
+    def _apply(self, entry):
+        """Applies one mutation entry; returns True when it changed the data."""
+        op, username = entry['op'], entry['username']
+        user = self._users.get(username)
+        if op == 'create_user':
+            if user is not None:
+                return False
+            self._users[username] = {"password": entry['password'], "collection": CardCollection()}
+            if entry.get('is_admin'):
+                self._users[username]['is_admin'] = True
+            return True
+        if user is None:
+            return False
+        if op == 'delete_user':
+            del self._users[username]
+            return True
+        if op == 'set_password':
+            if user['password'] == entry['password']:
+                return False
+            user['password'] = entry['password']
+            return True
+
+        collection = user['collection']
+        if op == 'add_card':
+            return collection.add(_copy_card(entry['card']))
+        if op == 'remove_card':
+            return collection.remove(entry['cert_number'])
+
+        card = collection.get(entry['cert_number'])
+        if card is None:
+            return False
+        tags = card.setdefault('hashtags', [])
+        if op == 'add_hashtag':
+            if entry['tag'] in tags:
+                return False
+            tags.append(entry['tag'])
+            return True
+        if op == 'remove_hashtag':
+            if entry['tag'] not in tags:
+                return False
+            tags.remove(entry['tag'])
+            return True
+        raise ValueError(f"Unknown store operation {op!r}")
+
+    # --- Users ---
+
+    def usernames(self):
+        with self._lock:
+            return list(self._users)
+
+    def get_user(self, username):
+        """The account fields of a user (without the collection), or None."""
+        with self._lock:
+            user = self._users.get(username)
+            if user is None:
+                return None
+            return {"password": user['password'], "is_admin": bool(user.get('is_admin'))}
+
+    def create_user(self, username, password_hash, is_admin=False):
+        """Adds a user with an empty collection; False when the username is taken."""
+        return self._mutate({"op": "create_user", "username": username,
+                             "password": password_hash, "is_admin": bool(is_admin)})
+
+    def set_password(self, username, password_hash):
+        with self._lock:
+            if username not in self._users:
+                return False
+            self._mutate({"op": "set_password", "username": username, "password": password_hash})
+            return True
+
+    def delete_user(self, username):
+        return self._mutate({"op": "delete_user", "username": username})
+
+    # --- Collections ---
+
+    def get_collection(self, username):
+        """A copy of a user's cards in the order they were added, or None for an unknown user."""
+        with self._lock:
+            user = self._users.get(username)
+            if user is None:
+                return None
+            return [_copy_card(card) for card in user['collection']]
+
+    def has_card(self, username, cert_number):
+        with self._lock:
+            user = self._users.get(username)
+            return user is not None and cert_number in user['collection']
+
+    def add_card(self, username, card):
+        """
+        Appends a card dict to a user's collection. Returns False when the cert is
+        already in the collection; raises KeyError for an unknown user.
+        """
+        card = dict(card, cert_number=normalize_cert(card['cert_number']))
+        with self._lock:
+            if username not in self._users:
+                raise KeyError(username)
+            return self._mutate({"op": "add_card", "username": username, "card": card})
+
+    def remove_card(self, username, cert_number):
+        return self._mutate({"op": "remove_card", "username": username,
+                             "cert_number": normalize_cert(cert_number)})
+
+    def add_hashtag(self, username, cert_number, tag):
+        """Tags a card in a user's collection; False when the card isn't there or already has the tag."""
+        return self._mutate({"op": "add_hashtag", "username": username,
+                             "cert_number": normalize_cert(cert_number), "tag": tag})
+
+    def remove_hashtag(self, username, cert_number, tag):
+        return self._mutate({"op": "remove_hashtag", "username": username,
+                             "cert_number": normalize_cert(cert_number), "tag": tag})
+
+    def _snapshot(self):
+        with self._lock:
+            return json.dumps(self._users, default=_encode_collection)
+
+
+class JournaledUserStore(_ResidentUsers):
+    """
+    users.json plus an append-only journal of the changes made since it was written.
+
+    Opening the store loads users.json and replays the journal over it; every
+    change afterwards costs one short line appended to <path>.journal instead of
+    rewriting the whole file. Once the journal passes compact_bytes a background
+    thread folds it into a fresh users.json, written to a temporary file and
+    renamed into place. Only one process may have the files open at a time.
+    """
+
+    def __init__(self, path='users.json', compact_bytes=1024 * 1024, fsync=True):
+        super().__init__(load_users_json(path))
+        self.path = path
+        self.journal_path = f"{path}.journal"
+        self.compacting_path = f"{path}.journal.compacting"
+        self.compact_bytes = compact_bytes
+        self.fsync = fsync
+        self.compactions = 0
+        self.replayed = 0
+
+        # A .compacting journal means the last compaction may not have reached users.json
+        for journal_path in (self.compacting_path, self.journal_path):
+            self.replayed += self._replay(journal_path)
+        self._journal = open(self.journal_path, 'a')
+        self._journal_bytes = self._journal.tell()
+
+        self._compact_needed = threading.Event()
+        self._compact_lock = threading.Lock()
+        threading.Thread(target=self._compact_loop, name='journal-compactor', daemon=True).start()
+        if self._journal_bytes >= self.compact_bytes or os.path.exists(self.compacting_path):
+            self._compact_needed.set()
+
+    def _replay(self, journal_path):
+        if not os.path.exists(journal_path):
+            return 0
+        replayed, good_bytes = 0, 0
+        with open(journal_path, 'rb') as f:
+            for line in f:
+                try:
+                    # Entries are appended with their newline, so a line without one was cut
+                    # short by a crash, even if what made it to disk happens to parse
+                    if not line.endswith(b'\n'):
+                        raise ValueError("entry has no trailing newline")
+                    entry = json.loads(line)
+                except ValueError:
+                    # A crash mid-append leaves a torn last line; drop it and everything after
+                    logging.warning(f"Truncating {journal_path} at a damaged entry after {replayed} entries")
+                    break
+                self._apply(entry)
+                replayed += 1
+                good_bytes += len(line)
+        if good_bytes != os.path.getsize(journal_path):
+            with open(journal_path, 'r+b') as f:
+                f.truncate(good_bytes)
+        return replayed
+
+    def _record(self, entry):
+        line = json.dumps(entry, separators=(',', ':')) + '\n'
+        self._journal.write(line)
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+        self._journal_bytes += len(line.encode())
+        if self._journal_bytes >= self.compact_bytes:
+            self._compact_needed.set()
+
+    def compact(self):
+        """Writes the current data to users.json and starts an empty journal."""
+        with self._compact_lock:
+            with self._lock:
+                # Entries from now on go to a fresh journal, so writers only wait for the serialization
+                snapshot = self._snapshot()
+                self._journal.close()
+                if not os.path.exists(self.compacting_path):
+                    os.replace(self.journal_path, self.compacting_path)
+                else:
+                    # An earlier compaction failed: keep its entries and fold this journal in after them
+                    with open(self.journal_path) as src, open(self.compacting_path, 'a') as dst:
+                        dst.write(src.read())
+                    os.unlink(self.journal_path)
+                self._journal = open(self.journal_path, 'a')
+                self._journal_bytes = 0
+            write_durable(self.path, snapshot)
+            os.unlink(self.compacting_path)
+            self.compactions += 1
+            logging.info(f"Compacted journal into {self.path}")
+
+    def close(self):
+        with self._lock:
+            self._journal.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "users": len(self._users),
+                "cards": sum(len(user['collection']) for user in self._users.values()),
+                "journal_bytes": self._journal_bytes,
+                "compactions": self.compactions,
+                "replayed": self.replayed,
+                "path": self.path,
+            }
+
+    def _compact_loop(self):
+        while True:
+            self._compact_needed.wait()
+            self._compact_needed.clear()
+            try:
+                self.compact()
+            except Exception:
+                logging.exception(f"Compacting {self.journal_path} failed")
+                time.sleep(5)
+                self._compact_needed.set()
+
+
+def run_on_sigterm(callback):
+    """
+    Calls callback when the process receives SIGTERM, then passes the signal on to
+    the handler installed before. atexit alone misses SIGTERM, which is how
+    docker stop and most process managers ask a server to shut down. When the
+    earlier handler was the default, the process exits with SystemExit so atexit
+    handlers still run (and so it exits at all as a container's PID 1, where the
+    default action is ignored). Only the main thread may install signal handlers,
+    so elsewhere this returns False.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return False
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def handle_sigterm(signum, frame):
+        try:
+            callback()
+        except Exception:
+            logging.exception("Shutdown callback failed on SIGTERM")
+        if callable(previous):
+            previous(signum, frame)
+        elif previous != signal.SIG_IGN:
+            raise SystemExit(128 + signum)
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    return True
+
+
+class ResidentUserStore(_ResidentUsers):
+    """
+    users.json loaded once and served from memory, with write-behind persistence.
+
+    Changes only mark the data dirty. A background thread writes users.json
+    debounce seconds after the first unsaved change, or right away once
+    max_pending changes are waiting, so a burst of edits costs one write. Each
+    write goes to a temporary file that is fsynced and renamed into place, and
+    pending changes are flushed on SIGTERM and at interpreter exit. Changes
+    made within the last debounce seconds are lost if the process is killed
+    outright (SIGKILL); only one process may have the file open at a time.
+    """
+
+    def __init__(self, path='users.json', debounce=1.0, max_pending=100):
+        super().__init__(load_users_json(path))
+        self.path = path
+        self.debounce = debounce
+        self.max_pending = max_pending
+        self._pending = 0
+        self._first_pending_at = None
+        self._wake = threading.Condition(self._lock)
+        # Reentrant: the SIGTERM handler may flush on a thread that is already flushing
+        self._flush_lock = threading.RLock()
+        self._closed = False
+        self.flushes = 0
+        threading.Thread(target=self._flush_loop, name='users-write-behind', daemon=True).start()
+        atexit.register(self.close)
+        if not run_on_sigterm(self.flush):
+            logging.warning(f"Not on the main thread; {path} is only flushed at interpreter exit")
+
+    def _record(self, entry):
+        self._pending += 1
+        if self._first_pending_at is None:
+            self._first_pending_at = time.monotonic()
+        if self._pending == 1 or self._pending >= self.max_pending:
+            self._wake.notify()
+
+    def flush(self):
+        """Writes pending changes to disk now; returns False when there were none."""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return False
+                snapshot = self._snapshot()
+                pending = self._pending
+                self._pending = 0
+                self._first_pending_at = None
+            try:
+                write_durable(self.path, snapshot)
+            except BaseException:
+                with self._lock:
+                    # Keep the changes marked as unsaved so the next flush retries them
+                    self._pending += pending
+                    if self._first_pending_at is None:
+                        self._first_pending_at = time.monotonic()
+                raise
+            self.flushes += 1
+            return True
+
+    def close(self):
+        """Stops the write-behind thread and flushes whatever is still pending."""
+        with self._lock:
+            self._closed = True
+            self._wake.notify()
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "users": len(self._users),
+                "cards": sum(len(user['collection']) for user in self._users.values()),
+                "pending": self._pending,
+                "flushes": self.flushes,
+                "path": self.path,
+            }
+
+    def _flush_loop(self):
+        while True:
+            with self._lock:
+                while not self._closed:
+                    if self._pending >= self.max_pending:
+                        break
+                    if self._pending:
+                        remaining = self._first_pending_at + self.debounce - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._wake.wait(remaining)
+                    else:
+                        self._wake.wait()
+                if self._closed:
+                    return
+            try:
+                self.flush()
+            except Exception:
+                logging.exception(f"Writing {self.path} failed")
+                time.sleep(self.debounce)
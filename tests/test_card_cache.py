@@ -0,0 +1,17 @@
+import pytest
+
+from card_cache import is_valid_cert, normalize_cert
+
+
+@pytest.mark.parametrize('cert', ['W1200368', ' w1200368 ', 'A0000000'])
+def test_valid_certs(cert):
+    assert is_valid_cert(cert)
+
+
+@pytest.mark.parametrize('cert', ['', 'W120036', 'W12003689', '1W200368', 'A١٢٣٤٥٦٧', 'É1200368'])
+def test_invalid_certs(cert):
+    assert not is_valid_cert(cert)
+
+
+def test_normalize_cert():
+    assert normalize_cert(' w1200368\n') == 'W1200368'
@@ -0,0 +1,77 @@
+import os
+
+import pytest
+
+import parsers
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'card.html')
+DOM_ENGINES = ('soup', 'lxml', 'partial')
+
+
+def fixture_page():
+    with open(FIXTURE, encoding='utf-8') as f:
+        return f.read()
+
+
+def page_variants():
+    page = fixture_page()
+    return {
+        'full': page,
+        'no_subset': page.replace('<div><span>Subset:</span> -</div>', ''),
+        'nested_value': page.replace('<span>WOLVERINE</span>', '<i>x</i><span> <b>WOL</b> VER<!--c--> </span>'),
+        'no_score': page.replace('TAG Score', 'Nope'),
+        'no_grade': page.replace('<div><div>10</div><div>GEM MINT</div></div>', ''),
+        'duplicate_label': page.replace('<main>', '<main><div><span>Player name:</span><span>FIRST</span></div>'),
+        'empty': '',
+        'blank': '   ',
+        'comment_only': '<!-- x -->',
+        'empty_document': '<html><body></body></html>',
+    }
+
+
+def test_fixture_page_fields():
+    assert parsers.parse_with_soup(fixture_page()) == {
+        'player_name': 'WOLVERINE',
+        'set_name': '1992 Marvel Masterpieces',
+        'subset': 'N/A',
+        'variation': 'Holo Foil',
+        'tag_score': '955',
+        'grade': '10',
+        'grade_name': 'GEM MINT',
+    }
+
+
+@pytest.mark.parametrize('variant', sorted(page_variants()))
+def test_dom_engines_agree(variant):
+    html = page_variants()[variant]
+    results = {name: parsers.PARSERS[name](html) for name in DOM_ENGINES}
+    assert results['lxml'] == results['soup']
+    assert results['partial'] == results['soup']
+
+
+@pytest.mark.parametrize('chunk_size', (7, 64, parsers.PARTIAL_CHUNK_SIZE))
+def test_partial_engine_agrees_at_any_chunk_size(chunk_size):
+    for html in page_variants().values():
+        assert parsers.parse_partial(html, chunk_size=chunk_size) == parsers.parse_with_soup(html)
+
+
+def test_partial_parser_reads_empty_body_as_missing_fields():
+    expected = parsers.parse_with_soup('')
+    assert set(expected.values()) == {'N/A'}
+    assert parsers.parse_partial('') == expected
+
+
+def test_default_engine_survives_empty_body():
+    # The embedded engine finds no JSON state and hands an empty page to the DOM fallback
+    assert parsers.get_parser()('') == parsers.parse_with_soup('')
+
+
+@pytest.mark.parametrize('html', [
+    '<html><body>no card here</body></html>',
+    '<script type="application/json">{"playerName": "WOLVERINE", "grade": "10"}</script>',
+])
+def test_embedded_engine_reports_each_phase_once(monkeypatch, html):
+    observed = []
+    monkeypatch.setattr(parsers, 'phase_observer', lambda phase, seconds: observed.append(phase))
+    parsers.parse_embedded(html)
+    assert sorted(observed) == ['extraction', 'parse']
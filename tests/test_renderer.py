@@ -0,0 +1,210 @@
+import os
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import lxml.html
+import pytest
+
+pytest.importorskip('selenium')
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.common.by import By
+
+from renderer import BrowserPool
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'card.html')
+SKELETON = '<html><body><div id="root">Loading...</div></body></html>'
+
+
+class CardPageHandler(BaseHTTPRequestHandler):
+    """Serves the fixture card page; ?render_delay=N says how long its scripts take to fill it in."""
+
+    def do_GET(self):
+        with open(FIXTURE, 'rb') as f:
+            body = f.read()
+        delay = self.path.partition('render_delay=')[2] or '0'
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('X-Render-Delay', delay)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope='module')
+def card_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), CardPageHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/card/"
+    server.shutdown()
+    server.server_close()
+
+
+class FakeDriver:
+    """
+    Stands in for a WebDriver: loads pages over HTTP and shows the skeleton until
+    the page's X-Render-Delay has passed, like a client-rendered app would.
+    """
+
+    def __init__(self):
+        self.html = ''
+        self.rendered_at = 0.0
+        self.alive = True
+        self.quit_calls = 0
+
+    def get(self, url):
+        with urllib.request.urlopen(url) as response:
+            self.html = response.read().decode('utf-8')
+            self.rendered_at = time.monotonic() + float(response.headers['X-Render-Delay'])
+
+    @property
+    def page_source(self):
+        return self.html if time.monotonic() >= self.rendered_at else SKELETON
+
+    def find_elements(self, by, xpath):
+        assert by == By.XPATH
+        return lxml.html.document_fromstring(self.page_source).xpath(xpath)
+
+    def execute_script(self, script):
+        if not self.alive:
+            raise WebDriverException("browser has gone away")
+        return 1
+
+    def quit(self):
+        self.quit_calls += 1
+
+
+class DriverFactory:
+    def __init__(self, failures=0):
+        self.drivers = []
+        self.failures = failures
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            if self.failures:
+                self.failures -= 1
+                raise WebDriverException("browser failed to start")
+            driver = FakeDriver()
+            self.drivers.append(driver)
+            return driver
+
+
+def make_pool(factory, **kwargs):
+    kwargs.setdefault('size', 2)
+    kwargs.setdefault('wait_timeout', 5)
+    kwargs.setdefault('lease_timeout', 5)
+    return BrowserPool(driver_factory=factory, **kwargs)
+
+
+def test_render_waits_for_the_card_to_fill_in(card_server):
+    pool = make_pool(DriverFactory())
+    started = time.monotonic()
+    html = pool.render(f"{card_server}A1234567?render_delay=0.3")
+    assert time.monotonic() - started >= 0.3
+    assert 'WOLVERINE' in html
+    assert pool.stats()['timeouts'] == 0
+
+
+def test_render_returns_partial_page_when_wait_times_out(card_server):
+    pool = make_pool(DriverFactory(), wait_timeout=0.3)
+    html = pool.render(f"{card_server}A1234567?render_delay=60")
+    assert html == SKELETON
+    assert pool.stats()['timeouts'] == 1
+
+
+def test_concurrent_renders_share_at_most_size_browsers(card_server):
+    factory = DriverFactory()
+    pool = make_pool(factory, size=2)
+    pages = []
+    threads = [
+        threading.Thread(target=lambda: pages.append(pool.render(f"{card_server}A1234567?render_delay=0.05")))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(pages) == 8 and all('WOLVERINE' in page for page in pages)
+    assert len(factory.drivers) == 2
+    assert pool.stats() == {"size": 2, "started": 2, "idle": 2, "leases": 8, "recycled": 0, "timeouts": 0}
+
+
+def test_unhealthy_browser_is_replaced_before_lease(card_server):
+    factory = DriverFactory()
+    pool = make_pool(factory, size=1)
+    pool.warm()
+    dead = factory.drivers[0]
+    dead.alive = False
+
+    assert 'WOLVERINE' in pool.render(f"{card_server}A1234567")
+    assert dead.quit_calls == 1
+    assert len(factory.drivers) == 2
+    assert pool.stats()['started'] == 1
+    assert pool.stats()['recycled'] == 1
+
+
+def test_browser_is_replaced_after_max_uses(card_server):
+    factory = DriverFactory()
+    pool = make_pool(factory, size=1, max_uses=2)
+    for _ in range(3):
+        pool.render(f"{card_server}A1234567")
+
+    first, second = factory.drivers
+    assert first.quit_calls == 1 and second.quit_calls == 0
+    assert pool.stats()['started'] == 1
+    assert pool.stats()['recycled'] == 1
+
+
+def test_driver_error_during_lease_frees_the_slot():
+    factory = DriverFactory()
+    pool = make_pool(factory, size=1)
+    with pytest.raises(WebDriverException):
+        with pool.lease():
+            raise WebDriverException("tab crashed")
+    assert pool.stats()['started'] == 0
+
+    with pool.lease() as driver:
+        assert driver is factory.drivers[1]
+    assert pool.stats()['started'] == 1
+
+
+def test_failed_browser_start_frees_the_slot():
+    factory = DriverFactory(failures=1)
+    pool = make_pool(factory, size=2)
+    pool.warm()
+    assert pool.stats()['started'] == 1
+    assert pool.stats()['idle'] == 1
+
+    pool.warm()
+    assert pool.stats()['started'] == 2
+    assert pool.stats()['idle'] == 2
+
+
+def test_lease_times_out_when_every_browser_is_busy():
+    pool = make_pool(DriverFactory(), size=1, lease_timeout=0.2)
+    with pool.lease():
+        with pytest.raises(TimeoutError):
+            with pool.lease():
+                pass
+    with pool.lease():
+        pass
+
+
+def test_close_quits_idle_browsers_and_refuses_leases():
+    factory = DriverFactory()
+    pool = make_pool(factory, size=2)
+    pool.warm()
+    pool.close()
+
+    assert [driver.quit_calls for driver in factory.drivers] == [1, 1]
+    assert pool.stats()['started'] == 0
+    with pytest.raises(RuntimeError):
+        with pool.lease():
+            pass
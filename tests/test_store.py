@@ -0,0 +1,297 @@
+import json
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import textwrap
+import time
+
+import pytest
+
+from store import CardCollection, JournaledUserStore, ResidentUserStore, SqliteUserStore, VersionConflict
+
+PROCESSES = 8
+OPERATIONS = 60
+
+
+def stress_worker(path, worker):
+    """Adds, tags and removes cards in a shared collection, and appends to a hot one with optimistic retries."""
+    store = SqliteUserStore(path, busy_timeout=30)
+    for i in range(OPERATIONS):
+        cert = f"P{worker:02d}{i:05d}"
+        assert store.add_card('shared', {'cert_number': cert, 'line1': str(worker)})
+        assert store.add_hashtag('shared', cert, f"w{worker}")
+        if i % 3 == 0:
+            assert store.remove_card('shared', cert)
+        while True:
+            version = store.collection_version('hot')
+            try:
+                store.add_card('hot', {'cert_number': f"H{worker:02d}{i:05d}"}, expected_version=version)
+                break
+            except VersionConflict:
+                continue  # another process changed the collection first; re-read and retry
+
+
+@pytest.fixture
+def store_path(tmp_path):
+    return str(tmp_path / 'users.sqlite3')
+
+
+def test_concurrent_processes_lose_no_writes(store_path):
+    store = SqliteUserStore(store_path)
+    store.create_user('shared', 'x')
+    store.create_user('hot', 'x')
+
+    with multiprocessing.Pool(PROCESSES) as pool:
+        pool.starmap(stress_worker, [(store_path, n) for n in range(PROCESSES)])
+
+    kept_per_worker = OPERATIONS - len(range(0, OPERATIONS, 3))
+    shared, shared_version = store.get_versioned_collection('shared')
+    assert len(shared) == PROCESSES * kept_per_worker
+    assert len({card['cert_number'] for card in shared}) == len(shared)
+    assert all(card['hashtags'] == [f"w{card['line1']}"] for card in shared)
+    # Every add, tag and remove bumps the version exactly once
+    assert shared_version == PROCESSES * (2 * OPERATIONS + len(range(0, OPERATIONS, 3)))
+
+    # Writes that hit a VersionConflict were retried, and each landed exactly once
+    hot, hot_version = store.get_versioned_collection('hot')
+    assert len(hot) == PROCESSES * OPERATIONS
+    assert hot_version == PROCESSES * OPERATIONS
+    assert store.stats()['collection_cards'] == len(shared) + len(hot)
+
+
+def test_stale_version_is_rejected(store_path):
+    store = SqliteUserStore(store_path)
+    store.create_user('ash', 'x')
+    _, version = store.get_versioned_collection('ash')
+    assert store.add_card('ash', {'cert_number': 'A1234567'}, expected_version=version)
+
+    with pytest.raises(VersionConflict) as conflict:
+        store.add_hashtag('ash', 'A1234567', 'psa', expected_version=version)
+    assert (conflict.value.expected, conflict.value.actual) == (version, version + 1)
+    assert store.get_collection('ash') == [{'cert_number': 'A1234567'}]
+
+    assert store.add_hashtag('ash', 'A1234567', 'psa', expected_version=version + 1)
+    assert store.collection_version('ash') == version + 2
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def users_path(tmp_path):
+    return str(tmp_path / 'users.json')
+
+
+def open_journaled(path):
+    # Large enough that no compaction starts on its own during a test
+    return JournaledUserStore(path, compact_bytes=1024 * 1024)
+
+
+def test_journal_is_replayed_on_open(users_path):
+    store = open_journaled(users_path)
+    store.create_user('ash', 'x')
+    store.add_card('ash', {'cert_number': 'a1234567', 'line1': 'Pikachu'})
+    store.add_hashtag('ash', 'A1234567', 'psa')
+    store.add_card('ash', {'cert_number': 'B1234567'})
+    store.remove_card('ash', 'B1234567')
+    store.close()
+    assert not os.path.exists(users_path)
+
+    reopened = open_journaled(users_path)
+    assert reopened.stats()['replayed'] == 5
+    assert reopened.get_collection('ash') == [{'cert_number': 'A1234567', 'line1': 'Pikachu', 'hashtags': ['psa']}]
+
+
+@pytest.mark.parametrize('torn_tail', [
+    b'{"op":"add_card","username":"ash","card":{"cert_',
+    # Parses, but the crash came before its newline reached the disk
+    b'{"op":"add_card","username":"ash","card":{"cert_number":"T1234567"}}',
+])
+def test_torn_journal_tail_is_truncated(users_path, torn_tail):
+    store = open_journaled(users_path)
+    store.create_user('ash', 'x')
+    store.add_card('ash', {'cert_number': 'A1234567'})
+    store.close()
+    with open(f"{users_path}.journal", 'ab') as f:
+        f.write(torn_tail)
+
+    store = open_journaled(users_path)
+    assert store.stats()['replayed'] == 2
+    assert [card['cert_number'] for card in store.get_collection('ash')] == ['A1234567']
+    # Entries appended after the truncation must survive the next restart
+    store.add_card('ash', {'cert_number': 'B1234567'})
+    store.add_card('ash', {'cert_number': 'C1234567'})
+    store.close()
+
+    store = open_journaled(users_path)
+    assert [card['cert_number'] for card in store.get_collection('ash')] == ['A1234567', 'B1234567', 'C1234567']
+
+
+def test_compaction_folds_journal_into_users_json(users_path):
+    store = open_journaled(users_path)
+    store.create_user('ash', 'x')
+    store.add_card('ash', {'cert_number': 'A1234567'})
+    store.compact()
+    assert os.path.getsize(f"{users_path}.journal") == 0
+    with open(users_path) as f:
+        assert json.load(f) == {'ash': {'password': 'x', 'collection': [{'cert_number': 'A1234567'}]}}
+    store.close()
+
+
+def test_interrupted_compaction_is_recovered(users_path):
+    store = open_journaled(users_path)
+    store.create_user('ash', 'x')
+    store.add_card('ash', {'cert_number': 'A1234567'})
+    store.compact()
+    store.add_card('ash', {'cert_number': 'B1234567'})
+    store.close()
+    # A crash after the journal was set aside but before users.json was rewritten
+    os.replace(f"{users_path}.journal", f"{users_path}.journal.compacting")
+    with open(f"{users_path}.journal", 'w') as f:
+        f.write('{"op":"add_card","username":"ash","card":{"cert_number":"C1234567"}}\n')
+
+    store = open_journaled(users_path)
+    expected = ['A1234567', 'B1234567', 'C1234567']
+    assert [card['cert_number'] for card in store.get_collection('ash')] == expected
+    # The leftover .compacting journal makes the store finish that compaction in the background
+    wait_for(lambda: not os.path.exists(f"{users_path}.journal.compacting"))
+    store.close()
+    with open(users_path) as f:
+        assert [card['cert_number'] for card in json.load(f)['ash']['collection']] == expected
+
+
+def read_users(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def test_resident_flush_writes_pending_changes(users_path):
+    # A long debounce keeps the write-behind thread out of the way
+    store = ResidentUserStore(users_path, debounce=60)
+    store.create_user('ash', 'x')
+    store.add_card('ash', {'cert_number': 'A1234567'})
+    assert not os.path.exists(users_path)
+    assert store.stats()['pending'] == 2
+
+    assert store.flush()
+    assert read_users(users_path) == {'ash': {'password': 'x', 'collection': [{'cert_number': 'A1234567'}]}}
+    assert store.stats()['pending'] == 0
+    assert not store.flush()
+    store.close()
+
+
+def test_resident_close_flushes_pending_changes(users_path):
+    store = ResidentUserStore(users_path, debounce=60)
+    store.create_user('ash', 'x')
+    store.add_card('ash', {'cert_number': 'A1234567'})
+    store.close()
+    assert ResidentUserStore(users_path).get_collection('ash') == [{'cert_number': 'A1234567'}]
+
+
+def test_resident_writes_after_debounce(users_path):
+    store = ResidentUserStore(users_path, debounce=0.05)
+    store.create_user('ash', 'x')
+    wait_for(lambda: os.path.exists(users_path))
+    assert store.stats()['flushes'] == 1
+    store.close()
+
+
+def test_resident_flushes_on_sigterm(users_path):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    script = textwrap.dedent(f"""
+        import os, signal, sys
+        sys.path.insert(0, {root!r})
+        from store import ResidentUserStore
+        store = ResidentUserStore({users_path!r}, debounce=60)
+        store.create_user('ash', 'x')
+        store.add_card('ash', {{'cert_number': 'A1234567'}})
+        os.kill(os.getpid(), signal.SIGTERM)
+        signal.pause()
+    """)
+    result = subprocess.run([sys.executable, '-c', script], timeout=30)
+    assert result.returncode == 128 + signal.SIGTERM
+    assert read_users(users_path)['ash']['collection'] == [{'cert_number': 'A1234567'}]
+
+
+def certs(cards):
+    return [card['cert_number'] for card in cards]
+
+
+def test_card_collection_rejects_duplicate_certs():
+    collection = CardCollection()
+    assert collection.add({'cert_number': 'A1234567', 'line1': 'first'})
+    assert not collection.add({'cert_number': ' a1234567 ', 'line1': 'second'})
+    assert len(collection) == 1
+    assert collection.get('a1234567')['line1'] == 'first'
+    assert 'A1234567' in collection and 'B1234567' not in collection
+
+
+def test_card_collection_remove_and_re_add_moves_card_to_the_end():
+    collection = CardCollection([{'cert_number': c} for c in ('A1234567', 'B1234567', 'C1234567')])
+    assert collection.remove('a1234567')
+    assert not collection.remove('A1234567')
+    assert certs(collection) == ['B1234567', 'C1234567']
+    assert collection.add({'cert_number': 'A1234567'})
+    assert certs(collection) == ['B1234567', 'C1234567', 'A1234567']
+
+
+def test_card_collection_keeps_first_of_duplicate_certs_on_load():
+    collection = CardCollection([
+        {'cert_number': 'A1234567', 'line1': 'first'},
+        {'cert_number': 'B1234567'},
+        {'cert_number': 'A1234567', 'line1': 'duplicate'},
+    ])
+    assert collection.to_list() == [{'cert_number': 'A1234567', 'line1': 'first'}, {'cert_number': 'B1234567'}]
+
+
+def test_resident_store_writes_collections_back_as_lists(users_path):
+    with open(users_path, 'w') as f:
+        json.dump({'ash': {'password': 'x', 'collection': [
+            {'cert_number': 'A1234567', 'hashtags': ['psa']},
+            {'cert_number': 'B1234567'},
+            {'cert_number': 'A1234567'},
+        ]}}, f)
+    store = ResidentUserStore(users_path, debounce=60)
+    assert certs(store.get_collection('ash')) == ['A1234567', 'B1234567']
+    assert store.has_card('ash', 'b1234567')
+    assert not store.add_card('ash', {'cert_number': 'b1234567'})
+    assert store.remove_card('ash', 'A1234567')
+    assert store.add_card('ash', {'cert_number': 'A1234567'})
+    store.close()
+
+    assert read_users(users_path) == {'ash': {'password': 'x', 'collection': [
+        {'cert_number': 'B1234567'},
+        {'cert_number': 'A1234567'},
+    ]}}
+
+
+def test_collections_are_copies(users_path):
+    store = ResidentUserStore(users_path, debounce=60)
+    store.create_user('ash', 'x')
+    store.add_card('ash', {'cert_number': 'A1234567', 'hashtags': ['psa']})
+    store.get_collection('ash')[0]['hashtags'].append('bgs')
+    assert store.get_collection('ash') == [{'cert_number': 'A1234567', 'hashtags': ['psa']}]
+    store.close()
+
+
+def test_sqlite_import_keeps_order_and_drops_duplicates(store_path, users_path):
+    with open(users_path, 'w') as f:
+        json.dump({'ash': {'password': 'x', 'collection': [
+            {'cert_number': 'B1234567', 'hashtags': ['psa']},
+            {'cert_number': 'A1234567'},
+            {'cert_number': 'b1234567'},
+        ]}}, f)
+    store = SqliteUserStore(store_path)
+    assert store.import_users_json(users_path) == 1
+    assert store.import_users_json(users_path) == 0
+    assert store.get_collection('ash') == [{'cert_number': 'B1234567', 'hashtags': ['psa']}, {'cert_number': 'A1234567'}]
+
+    assert store.remove_card('ash', 'B1234567')
+    assert store.add_card('ash', {'cert_number': 'B1234567'})
+    assert certs(store.get_collection('ash')) == ['A1234567', 'B1234567']
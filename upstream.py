@@ -0,0 +1,449 @@
+"""
+Shared HTTP plumbing for talking to my.taggrading.com.
+"""
+import ssl
+import time
+import logging
+import threading
+from collections import deque
+from email.utils import parsedate_to_datetime
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+
+class UpstreamThrottled(requests.exceptions.RequestException):
+    """Raised when the rate limiter would make a request wait longer than allowed."""
+
+
+class CircuitOpen(requests.exceptions.RequestException):
+    """Raised instead of calling the upstream while the circuit breaker is open."""
+
+
+# Per-thread total of time spent opening upstream connections (DNS, TCP and TLS handshake)
+_connect_clock = threading.local()
+
+
+def take_connect_seconds():
+    """Seconds the calling thread spent opening new upstream connections since the last call."""
+    seconds = getattr(_connect_clock, 'seconds', 0.0)
+    _connect_clock.seconds = 0.0
+    return seconds
+
+
+class _TimedConnect:
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            _connect_clock.seconds = getattr(_connect_clock, 'seconds', 0.0) + time.perf_counter() - started
+
+
+class TimedHTTPConnection(_TimedConnect, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(_TimedConnect, HTTPSConnection):
+    # TLS 1.3 session tickets arrive after the handshake, so sessions are saved once a
+    # response has been read, or just before a Connection: close response drops the socket
+
+    def getresponse(self, *args, **kwargs):
+        response = super().getresponse(*args, **kwargs)
+        self._remember_session()
+        return response
+
+    def close(self):
+        self._remember_session()
+        super().close()
+
+    def _remember_session(self):
+        if isinstance(self.ssl_context, SessionCachingContext) and isinstance(self.sock, ssl.SSLSocket):
+            self.ssl_context.remember(self.sock)
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class SessionCachingContext(ssl.SSLContext):
+    """
+    Client SSLContext that remembers the last TLS session of each host and offers
+    it when the next connection to that host is opened, so the server can resume
+    it with an abbreviated handshake. Python only resumes when a session is passed
+    to wrap_socket explicitly; sharing a context alone never does.
+    """
+
+    def __new__(cls, protocol=ssl.PROTOCOL_TLS_CLIENT, *args, **kwargs):
+        return super().__new__(cls, protocol, *args, **kwargs)
+
+    def __init__(self, *args, **kwargs):
+        self._sessions = {}
+        self._sessions_lock = threading.Lock()
+        self.handshakes = 0
+        self.resumed = 0
+
+    def wrap_socket(self, sock, *args, server_hostname=None, session=None, **kwargs):
+        if session is None and server_hostname:
+            with self._sessions_lock:
+                session = self._sessions.get(server_hostname)
+        ssl_sock = super().wrap_socket(sock, *args, server_hostname=server_hostname, session=session, **kwargs)
+        with self._sessions_lock:
+            self.handshakes += 1
+            if ssl_sock.session_reused:
+                self.resumed += 1
+        return ssl_sock
+
+    def remember(self, ssl_sock):
+        """Keeps an established connection's session for the next connection to the same host."""
+        session = ssl_sock.session
+        if session is not None and ssl_sock.server_hostname:
+            with self._sessions_lock:
+                self._sessions[ssl_sock.server_hostname] = session
+
+    def stats(self):
+        with self._sessions_lock:
+            return {"handshakes": self.handshakes, "resumed": self.resumed, "hosts": len(self._sessions)}
+
+
+def create_ssl_context():
+    """The verifying client context of ssl.create_default_context(), with TLS session resumption."""
+    context = SessionCachingContext()
+    context.load_default_certs(ssl.Purpose.SERVER_AUTH)
+    return context
+
+
+class PooledTLSAdapter(HTTPAdapter):
+    """
+    HTTPAdapter whose connection pools all share one SSL context, so certificate
+    loading happens once, every pooled connection is kept alive between requests,
+    and new connections resume the TLS session of an earlier one.
+    Time spent opening connections is reported through take_connect_seconds().
+    """
+
+    def __init__(self, ssl_context=None, **kwargs):
+        self.ssl_context = ssl_context or create_ssl_context()
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['ssl_context'] = self.ssl_context
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool,
+        }
+
+    def proxy_manager_for(self, *args, **kwargs):
+        kwargs['ssl_context'] = self.ssl_context
+        return super().proxy_manager_for(*args, **kwargs)
+
+
+def create_http_session(pool_size=16, retries=2, backoff_factor=0.3, user_agent=None):
+    """
+    Builds a requests.Session with a keep-alive connection pool of pool_size
+    connections per host. Only connection setup is retried; a read timeout fails
+    on the first attempt so the caller's rate limiter and circuit breaker see it.
+
+    The session is safe to share between threads: urllib3's pool hands out one
+    connection per request, and cookie storage is disabled so no per-request
+    state is written back to the session.
+    """
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=False,
+        status=0,
+        backoff_factor=backoff_factor,
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        raise_on_status=False,
+    )
+    adapter = PooledTLSAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        pool_block=False,
+        max_retries=retry,
+    )
+
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    session.headers['Connection'] = 'keep-alive'
+    if user_agent:
+        session.headers['User-Agent'] = user_agent
+
+    logging.info(f"Created upstream HTTP session (pool_size={pool_size}, retries={retries})")
+    return session
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key: the first caller runs the
+    function and every caller that arrives while it is running waits for, and
+    receives, that same result (or exception).
+    """
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+                self.executions += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "executions": self.executions,
+                "coalesced": self.coalesced,
+            }
+
+
+def parse_retry_after(value):
+    """Seconds to wait according to a Retry-After header (delta-seconds or HTTP date), or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket shared by every upstream call, whose refill rate adapts to the
+    upstream's feedback: it halves on a 429/503 (at most once per cooldown),
+    pauses entirely for any Retry-After, and creeps back up by increase
+    requests/second after each successful response, up to max_rate.
+    """
+
+    THROTTLE_STATUSES = (429, 503)
+
+    def __init__(self, rate=5.0, burst=10, min_rate=0.2, max_rate=20.0,
+                 decrease_factor=0.5, increase=0.05, cooldown=1.0):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.decrease_factor = decrease_factor
+        self.increase = increase
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self.acquired = 0
+        self.rejected = 0
+        self.throttled = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def acquire(self, max_wait=None):
+        """
+        Takes one token, sleeping until it is available. Returns the seconds spent
+        waiting, or None without taking a token when that would exceed max_wait.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = max(0.0, (1 - self._tokens) / self.rate, self._paused_until - now)
+            if max_wait is not None and wait > max_wait:
+                self.rejected += 1
+                return None
+            # Reserve the token now; waiters queue up behind it as negative balance
+            self._tokens -= 1
+            self.acquired += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def on_response(self, status_code, retry_after=None):
+        """Feeds an upstream response back into the rate."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if status_code in self.THROTTLE_STATUSES:
+                self.throttled += 1
+                if now - self._last_decrease >= self.cooldown:
+                    self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+                    self._last_decrease = now
+                    logging.warning(f"Upstream returned {status_code}, lowering rate to {self.rate:.2f}/s")
+                delay = parse_retry_after(retry_after)
+                if delay:
+                    self._paused_until = max(self._paused_until, now + delay)
+            elif status_code < 500:
+                self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "rate": self.rate,
+                "tokens": self._tokens,
+                "acquired": self.acquired,
+                "rejected": self.rejected,
+                "throttled": self.throttled,
+                "queue_wait_total": self.wait_total,
+                "queue_wait_max": self.wait_max,
+                "queue_wait_avg": (self.wait_total / self.acquired) if self.acquired else 0.0,
+            }
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+class CircuitBreaker:
+    """
+    Closed/open/half-open circuit breaker driven by the error and slow-call rates
+    of the calls made in the last window seconds.
+
+    Once at least min_calls were made in the window and either rate reaches its
+    threshold, the circuit opens and calls are refused for open_seconds. After
+    that, up to half_open_calls trial calls go through: a fast success closes the
+    circuit again, anything else re-opens it.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, window=60.0, min_calls=10, failure_rate=0.5, slow_call=5.0,
+                 slow_rate=0.8, open_seconds=30.0, half_open_calls=1):
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call = slow_call
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self._lock = threading.Lock()
+        self._calls = deque()  # (finished_at, failed, slow)
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._trials = 0
+        self._trial_started = 0.0
+        self.rejected = 0
+        self.opened = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def allow(self):
+        """True when a call may go to the upstream now."""
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            if state == self.HALF_OPEN and self._trials >= self.half_open_calls:
+                # A trial that never reported back (e.g. it was throttled) must not wedge the breaker
+                if now - self._trial_started < self.open_seconds:
+                    self.rejected += 1
+                    return False
+                self._trials = 0
+            if state == self.OPEN:
+                self.rejected += 1
+                return False
+            if state == self.HALF_OPEN:
+                self._trials += 1
+                self._trial_started = now
+            return True
+
+    def record(self, success, latency=0.0):
+        """Reports the outcome of a call that allow() let through."""
+        slow = latency >= self.slow_call
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            if state == self.HALF_OPEN:
+                if success and not slow:
+                    logging.info("Upstream circuit closed after a successful trial call")
+                    self._state = self.CLOSED
+                    self._calls.clear()
+                else:
+                    self._open(now)
+                return
+            if state == self.OPEN:
+                return
+
+            self._calls.append((now, not success, slow))
+            while self._calls and self._calls[0][0] < now - self.window:
+                self._calls.popleft()
+            total = len(self._calls)
+            if total < self.min_calls:
+                return
+            failures = sum(1 for _, failed, _ in self._calls if failed)
+            slow_calls = sum(1 for _, _, was_slow in self._calls if was_slow)
+            if failures / total >= self.failure_rate or slow_calls / total >= self.slow_rate:
+                self._open(now)
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            total = len(self._calls)
+            return {
+                "state": self._current_state(now),
+                "calls_in_window": total,
+                "failure_rate": (sum(1 for c in self._calls if c[1]) / total) if total else 0.0,
+                "slow_rate": (sum(1 for c in self._calls if c[2]) / total) if total else 0.0,
+                "opened": self.opened,
+                "rejected": self.rejected,
+            }
+
+    def _current_state(self, now):
+        if self._state == self.OPEN and now - self._opened_at >= self.open_seconds:
+            self._state = self.HALF_OPEN
+            self._trials = 0
+        return self._state
+
+    def _open(self, now):
+        logging.warning(f"Upstream circuit opened for {self.open_seconds}s")
+        self._state = self.OPEN
+        self._opened_at = now
+        self._calls.clear()
+        self.opened += 1